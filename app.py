@@ -1,21 +1,264 @@
+import contextlib
+import gzip
+import json
 import os
-from flask import Flask, request, abort, jsonify
+from functools import partial
+import click
+from flask import Flask, Response, request, abort, current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 
-from models import setup_db, Movie, Actor
-
-from auth.auth import AuthError, requires_auth
+from models import (setup_db, db, init_collection_versions, get_row_version,
+                    Movie, Actor)
+from db_pool import pool_stats
+from json_provider import init_json, jsonify
+from metrics import init_metrics, render_metrics, timed
+from query_stats import init_query_stats
+
+from auth.auth import (AuthError, requires_auth, check_permissions,
+                       jwks_store, token_cache, local_issuer, set_timer,
+                       JWT_DECODE_OPTIONS)
+from auth.issuer import LocalIssuer, load_roles
+from etags import (abort_failed_write, collection_etag,
+                   get_expected_versions, not_modified)
+from fieldsets import get_fieldset_args
+from filters import get_filter_args
+from pagination import get_page_args, paginate, seek
+from response_cache import cached_response, init_response_cache
+from bulk_import import IMPORT_FORMATS, import_records, import_request
+from export import EXPORT_FORMATS, export_chunks, export_response, gzip_chunks
+from streaming import stream_collection, stream_requested
 
 from datetime import datetime
 
+MOVIE_FIELDS = ('title', 'release_date')
+ACTOR_FIELDS = ('name', 'age', 'gender', 'movie_id')
+
+'''
+parse_batch(body, fields)
+    validates the body of a bulk create request up front:
+    a non-empty JSON array of at most BATCH_MAX_SIZE objects,
+    each carrying every one of the required fields
+    returns the records restricted to those fields
+'''
+
+
+def parse_batch(body, fields):
+    if not isinstance(body, list):
+        abort(400)
+
+    if not body or len(body) > current_app.config['BATCH_MAX_SIZE']:
+        abort(422)
+
+    records = []
+    for item in body:
+        if not isinstance(item, dict):
+            abort(422)
+        if any(item.get(field, None) is None for field in fields):
+            abort(422)
+        records.append({field: item[field] for field in fields})
+    return records
+
+'''
+parse_ids(body)
+    validates the `ids` of a bulk update or delete request up front:
+    a non-empty JSON array of at most BATCH_MAX_SIZE integers
+    returns the ids without duplicates, in request order
+'''
+
+
+def parse_ids(body):
+    if not isinstance(body, dict) or not isinstance(body.get('ids'), list):
+        abort(400)
+
+    ids = body['ids']
+    if not ids or len(ids) > current_app.config['BATCH_MAX_SIZE']:
+        abort(422)
+    if any(not isinstance(id, int) or isinstance(id, bool) for id in ids):
+        abort(422)
+    return list(dict.fromkeys(ids))
+
+
+'''
+parse_movie_id(body)
+    the `movie_id` of a bulk assignment: an integer or null (422
+    otherwise), checked up front so a batch never points actors at a
+    movie that does not exist (404)
+'''
+
+
+def parse_movie_id(body):
+    if 'movie_id' not in body:
+        abort(422)
+
+    movie_id = body['movie_id']
+    if movie_id is None:
+        return None
+    if not isinstance(movie_id, int) or isinstance(movie_id, bool):
+        abort(422)
+    if get_row_version(Movie, movie_id) is None:
+        abort(404)
+    return movie_id
+
+
+'''
+batch_results(ids, found)
+    the per-id outcome of a bulk request: 200 for the ids that
+    existed, 404 for the others
+'''
+
+
+def batch_results(ids, found):
+    found = set(found)
+    return [{'id': id, 'status': 200 if id in found else 404} for id in ids]
+
+
+'''
+parse_update(body, fields)
+    the values of a PATCH body: the given fields that are set
+    (empty values are ignored); a body that is not a JSON object
+    is a 400
+'''
+
+
+def parse_update(body, fields):
+    if not isinstance(body, dict):
+        abort(400)
+    return {field: body[field] for field in fields if body.get(field)}
+
 def create_app(test_config=None):
   # create and configure the app
   app = Flask(__name__)
+  app.config.from_mapping(
+      PAGE_SIZE_DEFAULT=int(os.environ.get('PAGE_SIZE_DEFAULT', 50)),
+      PAGE_SIZE_MAX=int(os.environ.get('PAGE_SIZE_MAX', 200)),
+      STREAM_BATCH_SIZE=int(os.environ.get('STREAM_BATCH_SIZE', 500)),
+      BATCH_MAX_SIZE=int(os.environ.get('BATCH_MAX_SIZE', 1000)),
+      RESPONSE_CACHE_BACKEND=os.environ.get('RESPONSE_CACHE_BACKEND', 'memory'),
+      RESPONSE_CACHE_URL=os.environ.get('RESPONSE_CACHE_URL', None),
+      RESPONSE_CACHE_MAX_BYTES=int(
+          os.environ.get('RESPONSE_CACHE_MAX_BYTES', 8 * 1024 * 1024)),
+      RESPONSE_CACHE_TTL=int(os.environ.get('RESPONSE_CACHE_TTL', 30)),
+      CREATE_SCHEMA_ON_STARTUP=os.environ.get(
+          'CREATE_SCHEMA_ON_STARTUP', 'false').lower() in ('1', 'true', 'yes'),
+      METRICS_ENABLED=os.environ.get(
+          'METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+      SQL_QUERY_BUDGET=int(os.environ.get('SQL_QUERY_BUDGET', 10)),
+      JSON_BACKEND=os.environ.get('JSON_BACKEND', 'auto'),
+      IMPORT_BATCH_SIZE=int(os.environ.get('IMPORT_BATCH_SIZE', 5000)),
+  )
+  if test_config is not None:
+      app.config.update(test_config)
+  init_json(app)
   setup_db(app)
+  init_response_cache(app)
+  init_metrics(app)
+  set_timer(timed)
+  init_query_stats(app)
 
   CORS(app)
 
+  @app.cli.command('init-db')
+  def init_db():
+      """Create the tables that do not exist yet."""
+      db.create_all()
+      init_collection_versions()
+
+  @app.cli.command('create-signing-key')
+  @click.argument('path')
+  @click.option('--jwks', default=None,
+                help='Also write the public key set to this file.')
+  def create_signing_key(path, jwks):
+      """Write a new RSA key for LOCAL_SIGNING_KEY."""
+      issuer = LocalIssuer.generate(JWT_DECODE_OPTIONS['issuer'],
+                                    JWT_DECODE_OPTIONS['audience'])
+      issuer.write_key(path)
+      if jwks:
+          click.echo('JWKS_URL=%s' % issuer.write_jwks(jwks))
+
+  @app.cli.command('issue-token')
+  @click.argument('role')
+  @click.option('--expires-in', default=86400, show_default=True,
+                help='Lifetime of the token in seconds.')
+  def issue_token(role, expires_in):
+      """Print a token for ROLE signed with LOCAL_SIGNING_KEY."""
+      if local_issuer is None:
+          raise click.UsageError('LOCAL_SIGNING_KEY is not set')
+      # the roles are read here, not when the app is created
+      roles = load_roles()
+      if role not in roles:
+          raise click.BadParameter(
+              'choose from %s' % ', '.join(sorted(roles)), param_hint='ROLE')
+      click.echo(local_issuer.mint_role(role, roles, expires_in=expires_in))
+
+  @app.cli.command('export')
+  @click.argument('kind', type=click.Choice(['movies', 'actors', 'cast']))
+  @click.option('--format', 'fmt', default='ndjson', show_default=True,
+                type=click.Choice(sorted(EXPORT_FORMATS)))
+  @click.option('--output', '-o', default='-',
+                help='File to write to, standard output by default.')
+  @click.option('--gzip', 'compress', is_flag=True,
+                help='Gzip the output.')
+  @click.option('--batch-size', default=None, type=int,
+                help='Rows per batch, STREAM_BATCH_SIZE by default.')
+  def export(kind, fmt, output, compress, batch_size):
+      """Write every movie, actor or actor with their movie (cast)."""
+      chunks = export_chunks(kind, fmt, batch_size)
+      if compress:
+          chunks = gzip_chunks(chunks)
+      with click.open_file(output, 'wb' if compress else 'w') as f:
+          for chunk in chunks:
+              f.write(chunk)
+
+  @app.cli.command('import')
+  @click.argument('kind', type=click.Choice(['movies', 'actors']))
+  @click.argument('path')
+  @click.option('--format', 'fmt', default=None,
+                type=click.Choice(IMPORT_FORMATS),
+                help='Format of the file, guessed from its name by default.')
+  @click.option('--errors', 'errors_path', default=None,
+                help='Write the rejected rows to this file as NDJSON.')
+  @click.option('--batch-size', default=None, type=int,
+                help='Rows per batch, IMPORT_BATCH_SIZE by default.')
+  @click.option('--dedupe', is_flag=True,
+                help='Skip rows equal to one already in the table '
+                     'or to an earlier line.')
+  def import_catalog(kind, path, fmt, errors_path, batch_size, dedupe):
+      """Load the movies or actors of a CSV or NDJSON file (- for stdin)."""
+      model, fields = ((Movie, MOVIE_FIELDS) if kind == 'movies'
+                       else (Actor, ACTOR_FIELDS))
+      name = path[:-3] if path.endswith('.gz') else path
+      if fmt is None:
+          fmt = 'csv' if name.endswith('.csv') else 'ndjson'
+
+      def progress(result):
+          click.echo('read %d, loaded %d, rejected %d'
+                     % (result.read, result.loaded, result.errors), err=True)
+
+      with contextlib.ExitStack() as stack:
+          if path == '-':
+              lines = click.get_text_stream('stdin', encoding='utf-8')
+          elif path.endswith('.gz'):
+              lines = stack.enter_context(
+                  gzip.open(path, 'rt', encoding='utf-8', newline=''))
+          else:
+              lines = stack.enter_context(
+                  open(path, encoding='utf-8', newline=''))
+          on_error = None
+          if errors_path:
+              errors = stack.enter_context(open(errors_path, 'w'))
+
+              def on_error(line, messages, record):
+                  errors.write(json.dumps(
+                      {'line': line, 'errors': messages, 'record': record},
+                      default=str) + '\n')
+
+          result = import_records(model, fields, lines, fmt, batch_size,
+                                  on_error=on_error, progress=progress,
+                                  dedupe=dedupe)
+      click.echo('inserted %d, skipped %d, rejected %d'
+                 % (result.inserted, result.skipped, result.errors))
+
   # CORS Headers
   @app.after_request
   def after_request(response):
@@ -35,32 +278,131 @@ def create_app(test_config=None):
               "message": 'welcome'
           })
 
+  @app.route('/health/pool')
+  def get_pool_stats():
+    return jsonify({
+              "success": True,
+              "pool": pool_stats(db.engine)
+          })
+
+  @app.route('/metrics')
+  def get_metrics():
+    samples = {}
+    for name, value in jwks_store.stats().items():
+        samples[('auth_jwks_cache_%s' % name,
+                 'JWKS cache %s.' % name, 'gauge')] = value
+    for name, value in token_cache.stats().items():
+        samples[('auth_token_cache_%s' % name,
+                 'Verified token cache %s.' % name, 'gauge')] = value
+    cache = app.extensions.get('response_cache')
+    if cache is not None:
+        for name, value in cache.stats().items():
+            samples[('response_cache_%s' % name,
+                     'Response cache %s.' % name, 'gauge')] = value
+    return Response(render_metrics(samples),
+                    mimetype='text/plain; version=0.0.4')
+
   @app.route('/movies', methods=['GET'])
   @requires_auth('view:movies')
+  @cached_response('movies')
   def retrieve_movies(payload):
+      criteria, sort = get_filter_args(Movie)
+      columns, fields, include = get_fieldset_args(Movie, sort)
+      limit, position = get_page_args(Movie, sort)
+      format_rows = partial(Movie.format_rows, fields=fields, include=include)
+
+      etag = collection_etag('movies')
+      unchanged = not_modified(etag)
+      if unchanged is not None:
+          return unchanged
+
+      query = Movie.projected(columns).filter(*criteria)
+      if stream_requested():
+          response = stream_collection(
+              'movies', seek(query, Movie, position, sort), format_rows)
+          response.set_etag(etag, weak=True)
+          return response
       try:
-          movies = Movie.query.all()
-          movies = [movie.format() for movie in movies]
-          return jsonify({
-              "success": True,
-              "movies": movies
-          })
+          with timed('db'):
+              movies, next_cursor = paginate(
+                  query, Movie, limit, position, sort)
+          with timed('format'):
+              movies = format_rows(movies)
+          with timed('json'):
+              response = jsonify({
+                  "success": True,
+                  "movies": movies,
+                  "next": next_cursor
+              })
+          response.set_etag(etag, weak=True)
+          return response
       except:
           abort(422)
 
   @app.route('/actors', methods=['GET'])
   @requires_auth('view:actors')
+  @cached_response('actors')
   def retrieve_actors(payload):
+      criteria, sort = get_filter_args(Actor)
+      columns, fields, include = get_fieldset_args(Actor, sort)
+      limit, position = get_page_args(Actor, sort)
+      format_rows = partial(Actor.format_rows, fields=fields, include=include)
+
+      etag = collection_etag('actors')
+      unchanged = not_modified(etag)
+      if unchanged is not None:
+          return unchanged
+
+      query = Actor.projected(columns).filter(*criteria)
+      if stream_requested():
+          response = stream_collection(
+              'actors', seek(query, Actor, position, sort), format_rows)
+          response.set_etag(etag, weak=True)
+          return response
       try:
-          actors = Actor.query.all()
-          actors = [actor.format() for actor in actors]
-          return jsonify({
-              "success": True,
-              "actors": actors
-          })
+          with timed('db'):
+              actors, next_cursor = paginate(
+                  query, Actor, limit, position, sort)
+          with timed('format'):
+              actors = format_rows(actors)
+          with timed('json'):
+              response = jsonify({
+                  "success": True,
+                  "actors": actors,
+                  "next": next_cursor
+              })
+          response.set_etag(etag, weak=True)
+          return response
       except:
           abort(422)
 
+  @app.route('/export/movies')
+  @requires_auth('view:movies')
+  def export_movies(payload):
+      return export_response('movies')
+
+  @app.route('/export/actors')
+  @requires_auth('view:actors')
+  def export_actors(payload):
+      return export_response('actors')
+
+  @app.route('/export/cast')
+  @requires_auth('view:actors')
+  def export_cast(payload):
+      # the rows carry the titles and release dates of the movies too
+      check_permissions('view:movies', payload)
+      return export_response('cast')
+
+  @app.route('/import/movies', methods=['POST'])
+  @requires_auth('post:movies')
+  def import_movies(payload):
+      return import_request(Movie, MOVIE_FIELDS)
+
+  @app.route('/import/actors', methods=['POST'])
+  @requires_auth('post:actors')
+  def import_actors(payload):
+      return import_request(Actor, ACTOR_FIELDS)
+
   @app.route('/movies', methods=['POST'])
   @requires_auth('post:movies')
   def create_movie(payload):
@@ -116,107 +458,155 @@ def create_app(test_config=None):
       except:
           abort(422)
 
-  @app.route('/movies/<int:movie_id>', methods=['DELETE'])
-  @requires_auth('delete:movies')
-  def delete_movie(payload, movie_id):
+  @app.route('/movies/batch', methods=['POST'])
+  @requires_auth('post:movies')
+  def create_movies(payload):
+      records = parse_batch(request.get_json(), MOVIE_FIELDS)
       try:
-          movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
-
-          if movie is None:
-              abort(422)
-
-          movie.delete()
+          ids = Movie.insert_many(records)
 
           return jsonify({
-              'success': True,
-              'deleted': movie_id
+              "success": True,
+              "ids": ids
           })
       except:
-        abort(422)
+          abort(422)
 
-  @app.route('/actors/<int:actor_id>', methods=['DELETE'])
-  @requires_auth('delete:actors')
-  def delete_actor(payload, actor_id):
+  @app.route('/actors/batch', methods=['POST'])
+  @requires_auth('post:actors')
+  def create_actors(payload):
+      records = parse_batch(request.get_json(), ACTOR_FIELDS)
       try:
-          actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
-
-          if actor is None:
-              abort(422)
-
-          actor.delete()
+          ids = Actor.insert_many(records)
 
           return jsonify({
-              'success': True,
-              'deleted': actor_id
+              "success": True,
+              "ids": ids
           })
       except:
           abort(422)
 
-  @app.route('/movies/<int:movie_id>', methods=['PATCH'])
-  @requires_auth('update:movies')
-  def update_movie(payload, movie_id):
+  @app.route('/actors/batch', methods=['PATCH'])
+  @requires_auth('update:actors')
+  def assign_actors(payload):
+      body = request.get_json()
+      ids = parse_ids(body)
+      movie_id = parse_movie_id(body)
       try:
-          updated_movie = Movie.query.get(movie_id)
+          found = Actor.update_many(ids, {'movie_id': movie_id})
 
-          if not updated_movie:
-              abort(422)
-
-          body = request.get_json()
+          return jsonify({
+              "success": True,
+              "results": batch_results(ids, found)
+          })
+      except:
+          abort(422)
 
-          title = body.get('title', None)
-          release_date = body.get('release_date', None)
+  @app.route('/movies/batch', methods=['DELETE'])
+  @requires_auth('delete:movies')
+  def delete_movies(payload):
+      ids = parse_ids(request.get_json())
+      try:
+          found = Movie.delete_many(ids)
 
-          if title:
-              updated_movie.title = title
-          if release_date:
-              updated_movie.release_date = release_date
+          return jsonify({
+              "success": True,
+              "results": batch_results(ids, found)
+          })
+      except:
+          abort(422)
 
-          updated_movie.update()
+  @app.route('/actors/batch', methods=['DELETE'])
+  @requires_auth('delete:actors')
+  def delete_actors(payload):
+      ids = parse_ids(request.get_json())
+      try:
+          found = Actor.delete_many(ids)
 
           return jsonify({
               "success": True,
-              "updated": updated_movie.format()
+              "results": batch_results(ids, found)
           })
       except:
           abort(422)
 
-  @app.route('/actors/<int:actor_id>', methods=['PATCH'])
-  @requires_auth('update:actors')
-  def update_actor(payload, actor_id):
+  @app.route('/movies/<int:movie_id>', methods=['DELETE'])
+  @requires_auth('delete:movies')
+  def delete_movie(payload, movie_id):
+      versions = get_expected_versions()
       try:
-          actor = Actor.query.get(actor_id)
+          deleted = Movie.delete_by_id(movie_id, versions)
+      except:
+          abort(422)
 
-          if not actor:
-              abort(422)
+      if not deleted:
+          abort_failed_write(Movie, movie_id)
 
-          body = request.get_json()
+      return jsonify({
+          'success': True,
+          'deleted': movie_id
+      })
 
-          name = body.get('name', None)
-          age = body.get('age', None)
-          gender = body.get('gender', None)
-          movie_id = body.get('movie_id', None)
+  @app.route('/actors/<int:actor_id>', methods=['DELETE'])
+  @requires_auth('delete:actors')
+  def delete_actor(payload, actor_id):
+      versions = get_expected_versions()
+      try:
+          deleted = Actor.delete_by_id(actor_id, versions)
+      except:
+          abort(422)
 
-          if name:
-              actor.name = name
-          if age:
-              actor.age = age
-          if gender:
-              actor.gender = gender
-          if movie_id:
-              actor.movie_id = movie_id
-
-          try:
-              actor.update()
-          except BaseException:
-              abort(422)
+      if not deleted:
+          abort_failed_write(Actor, actor_id)
 
-          return jsonify({
-              "success": True,
-              'id': actor.id
-          })
+      return jsonify({
+          'success': True,
+          'deleted': actor_id
+      })
+
+  @app.route('/movies/<int:movie_id>', methods=['PATCH'])
+  @requires_auth('update:movies')
+  def update_movie(payload, movie_id):
+      body = request.get_json()
+      values = parse_update(body, MOVIE_FIELDS)
+      versions = get_expected_versions(body)
+      try:
+          updated_movie = Movie.update_by_id(movie_id, values, versions)
+      except:
+          abort(422)
+
+      if updated_movie is None:
+          abort_failed_write(Movie, movie_id)
+
+      response = jsonify({
+          "success": True,
+          "updated": Movie.format_rows([updated_movie])[0]
+      })
+      response.set_etag(str(updated_movie.version))
+      return response
+
+  @app.route('/actors/<int:actor_id>', methods=['PATCH'])
+  @requires_auth('update:actors')
+  def update_actor(payload, actor_id):
+      body = request.get_json()
+      values = parse_update(body, ACTOR_FIELDS)
+      versions = get_expected_versions(body)
+      try:
+          actor = Actor.update_by_id(actor_id, values, versions)
       except:
           abort(422)
 
+      if actor is None:
+          abort_failed_write(Actor, actor_id)
+
+      response = jsonify({
+          "success": True,
+          'id': actor.id,
+          'version': actor.version
+      })
+      response.set_etag(str(actor.version))
+      return response
+
   # Error Handling
 
   @app.errorhandler(422)
@@ -243,6 +633,22 @@ def create_app(test_config=None):
           "message": "bad request"
       }), 400
 
+  @app.errorhandler(409)
+  def conflict(error):
+      return jsonify({
+          "success": False,
+          "error": 409,
+          "message": "version conflict"
+      }), 409
+
+  @app.errorhandler(412)
+  def precondition_failed(error):
+      return jsonify({
+          "success": False,
+          "error": 412,
+          "message": "precondition failed"
+      }), 412
+
   @app.errorhandler(AuthError)
   def auth_error(auth_error):
       return jsonify({
@@ -1,14 +1,82 @@
 import json, os
+from contextlib import nullcontext
 from flask import request, _request_ctx_stack, abort
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+
+from .issuer import LocalIssuer
+from .jwks import JWKSKeyStore
+from .token_cache import VerifiedTokenCache
 
 
 AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
 ALGORITHMS = [ os.environ['ALGORITHMS'] ]
 API_AUDIENCE = os.environ['API_AUDIENCE']
 
+## JWKS key store
+'''
+Auth0 signing keys are cached in-process instead of being fetched on
+every request; see auth/jwks.py for the refresh rules.
+JWKS_URL points the store somewhere else, e.g. a file:// url written
+by LocalIssuer.write_jwks.
+'''
+jwks_store = JWKSKeyStore(
+    os.environ.get('JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json'),
+    algorithm=ALGORITHMS[0],
+    default_ttl=int(os.environ.get('JWKS_CACHE_TTL', 600)),
+    min_refresh_interval=int(os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30)))
+
+## JWT decode options
+'''
+Algorithm, audience and issuer checks are the same for every token,
+so they are set up once here and reused by verify_decode_jwt.
+'''
+JWT_DECODE_OPTIONS = {
+    'algorithms': ALGORITHMS,
+    'audience': API_AUDIENCE,
+    'issuer': 'https://' + AUTH0_DOMAIN + '/',
+}
+
+## Local signing key
+'''
+With LOCAL_SIGNING_KEY set to the path of an RSA private key (see
+`flask create-signing-key`), tokens are minted locally by local_issuer
+and verified against its key alone; Auth0 is never contacted and its
+tokens are not accepted.
+'''
+local_issuer = None
+if os.environ.get('LOCAL_SIGNING_KEY'):
+    local_issuer = LocalIssuer.from_file(
+        os.environ['LOCAL_SIGNING_KEY'], JWT_DECODE_OPTIONS['issuer'],
+        API_AUDIENCE)
+    jwks_store.load(local_issuer.jwks())
+
+## Verified token cache
+'''
+Payloads of tokens that passed verify_decode_jwt, so repeat callers
+skip the RS256 signature check; see auth/token_cache.py.
+'''
+token_cache = VerifiedTokenCache(
+    max_bytes=int(os.environ.get('TOKEN_CACHE_MAX_BYTES', 1024 * 1024)),
+    max_ttl=int(os.environ.get('TOKEN_CACHE_MAX_TTL', 300)))
+
+## Request timing
+'''
+requires_auth runs inside timer('auth'), a context manager factory
+such as metrics.timed that the application passes to set_timer;
+nothing is timed until then.
+'''
+def _no_timer(phase):
+    return nullcontext()
+
+
+_timer = _no_timer
+
+
+def set_timer(timer):
+    global _timer
+    _timer = timer or _no_timer
+
 ## AuthError Exception
 '''
 AuthError Exception
@@ -97,6 +165,7 @@ def check_permissions(permission, payload):
         token: a json web token (string)
     it should be an Auth0 token with key id (kid)
     it should verify the token using Auth0 /.well-known/jwks.json
+        (served from jwks_store, which refetches on expiry or unknown kid)
     it should decode the payload from the token
     it should validate the claims
     return the decoded payload
@@ -106,34 +175,19 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-    if rsa_key:
+    key = jwks_store.get_key(unverified_header['kid'])
+    if key is not None:
         try:
-            payload = jwt.decode(
-                token,
-                rsa_key,
-                algorithms=ALGORITHMS,
-                audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
-            )
+            # A single-entry mapping makes jose use the pre-built key
+            # object as is instead of parsing a JWK dict again.
+            payload = jwt.decode(token, {'key': key}, **JWT_DECODE_OPTIONS)
 
             return payload
 
@@ -168,6 +222,7 @@ def verify_decode_jwt(token):
         permission: string permission (i.e. 'post:drink')
     it should use the get_token_auth_header method to get the token
     it should use the verify_decode_jwt method to decode the jwt
+        (unless the token's payload is already in token_cache)
     it should use the check_permissions method validate claims
     and check the requested permission
     return the decorator which passes the decoded payload
@@ -179,9 +234,13 @@ def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            with _timer('auth'):
+                token = get_token_auth_header()
+                payload = token_cache.get(token)
+                if payload is None:
+                    payload = verify_decode_jwt(token)
+                    token_cache.put(token, payload)
+                check_permissions(permission, payload)
             return f(payload, *args, **kwargs)
         return wrapper
     return requires_auth_decorator
\ No newline at end of file
@@ -0,0 +1,95 @@
+import base64
+import json
+import os
+import time
+
+from Crypto.PublicKey import RSA
+from jose import jwt
+
+
+# The roles, and the permissions each one is granted in Auth0.
+ROLES_PATH = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'auth0_token.json')
+
+
+def long_to_base64(value):
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+'''
+load_roles(path=ROLES_PATH)
+    returns {role: permissions} as configured in Auth0
+'''
+
+
+def load_roles(path=ROLES_PATH):
+    with open(path) as f:
+        roles = json.load(f)['roles']
+    return {role: config['permissions'] for role, config in roles.items()}
+
+
+'''
+LocalIssuer
+    Signs RS256 access tokens with a local RSA key instead of Auth0, for
+    tests, benchmarks and offline development. Tokens carry the same
+    iss, aud and permissions claims as the Auth0 ones, so they go
+    through verify_decode_jwt unchanged once the key store serves the
+    issuer's JWKS (in-process with JWKSKeyStore.load, or from a file
+    written by write_jwks).
+'''
+
+
+class LocalIssuer:
+    def __init__(self, private_key, issuer, audience, kid='local'):
+        self.private_key = private_key
+        self.issuer = issuer
+        self.audience = audience
+        self.kid = kid
+        self._pem = private_key.exportKey('PEM').decode('ascii')
+
+    @classmethod
+    def generate(cls, issuer, audience, kid='local', bits=2048):
+        return cls(RSA.generate(bits), issuer, audience, kid)
+
+    @classmethod
+    def from_file(cls, path, issuer, audience, kid='local'):
+        with open(path) as f:
+            return cls(RSA.importKey(f.read()), issuer, audience, kid)
+
+    def write_key(self, path):
+        with open(path, 'w') as f:
+            f.write(self._pem + '\n')
+        os.chmod(path, 0o600)
+
+    def jwks(self):
+        return {'keys': [{
+            'kty': 'RSA', 'use': 'sig', 'alg': 'RS256', 'kid': self.kid,
+            'n': long_to_base64(self.private_key.n),
+            'e': long_to_base64(self.private_key.e),
+        }]}
+
+    def write_jwks(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.jwks(), f)
+        return 'file://' + os.path.abspath(path)
+
+    def mint(self, permissions, subject='local|user', expires_in=86400):
+        now = int(time.time())
+        claims = {
+            'iss': self.issuer,
+            'sub': subject,
+            'aud': self.audience,
+            'iat': now,
+            'exp': now + expires_in,
+            'permissions': list(permissions),
+        }
+        return jwt.encode(claims, self._pem, algorithm='RS256',
+                          headers={'kid': self.kid})
+
+    def mint_role(self, role, roles=None, expires_in=86400):
+        roles = load_roles() if roles is None else roles
+        if role not in roles:
+            raise KeyError('unknown role %r' % role)
+        return self.mint(roles[role], subject='local|%s' % role,
+                         expires_in=expires_in)
@@ -0,0 +1,146 @@
+import json
+import re
+import threading
+import time
+from urllib.request import urlopen
+
+from jose import jwk
+
+
+_MAX_AGE_RE = re.compile(r'max-age\s*=\s*(\d+)', re.IGNORECASE)
+
+
+'''
+parse_max_age(cache_control)
+    returns the max-age directive of a Cache-Control header in seconds,
+    or None if the header is missing or carries no max-age
+'''
+
+
+def parse_max_age(cache_control):
+    if not cache_control:
+        return None
+    match = _MAX_AGE_RE.search(cache_control)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+'''
+build_key(key, algorithm)
+    parses a JWK into the backend's public key object once, so the RSA
+    modulus and exponent are not decoded again on every verification
+'''
+
+
+def build_key(key, algorithm):
+    return jwk.construct(key, key.get('alg', algorithm)).prepared_key
+
+
+'''
+JWKSKeyStore
+    An in-process cache of the Auth0 JSON Web Key Set.
+    The document is fetched once and kept for as long as the response's
+    Cache-Control max-age allows (default_ttl when absent, capped at
+    max_ttl). A lookup for an unknown kid forces a single refetch, at
+    most once every min_refresh_interval seconds, so signing key
+    rotation is picked up without letting bad tokens hammer Auth0.
+    Keys are indexed by kid as ready-to-use public key objects.
+'''
+
+
+class JWKSKeyStore:
+    def __init__(self, url, algorithm='RS256', default_ttl=600, max_ttl=86400,
+                 min_refresh_interval=30, timeout=5):
+        self.url = url
+        self.algorithm = algorithm
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+        self._keys = {}
+        self._expires_at = 0
+        self._last_fetch = None
+        self._lock = threading.Lock()
+
+    def fetch(self):
+        response = urlopen(self.url, timeout=self.timeout)
+        jwks = json.loads(response.read())
+        headers = getattr(response, 'headers', None)
+        max_age = parse_max_age(headers.get('Cache-Control') if headers else None)
+        if max_age is None:
+            max_age = self.default_ttl
+        return jwks, min(max_age, self.max_ttl)
+
+    def refresh(self, kid=None):
+        with self._lock:
+            now = time.monotonic()
+            if kid is not None and now < self._expires_at and (
+                    kid in self._keys or not self._can_force_refresh()):
+                # Another thread refreshed the keys while this one waited.
+                return
+            self._last_fetch = now
+            jwks, ttl = self.fetch()
+            self._keys = self.index(jwks)
+            self._expires_at = now + ttl
+            self.refreshes += 1
+
+    def load(self, jwks):
+        # Serve a fixed key set (e.g. a LocalIssuer's) and never fetch.
+        with self._lock:
+            self._keys = self.index(jwks)
+            self._expires_at = float('inf')
+            self._last_fetch = time.monotonic()
+            self.min_refresh_interval = float('inf')
+
+    def index(self, jwks):
+        keys = {}
+        for key in jwks.get('keys', []):
+            if 'kid' not in key or key.get('use', 'sig') != 'sig':
+                continue
+            try:
+                keys[key['kid']] = build_key(key, self.algorithm)
+            except Exception:
+                # Skip keys our backend cannot use rather than the whole set.
+                continue
+        return keys
+
+    def _can_force_refresh(self):
+        if self._last_fetch is None:
+            return True
+        elapsed = time.monotonic() - self._last_fetch
+        return elapsed >= self.min_refresh_interval
+
+    def get_key(self, kid):
+        if time.monotonic() < self._expires_at:
+            key = self._keys.get(kid)
+            if key is not None:
+                self.hits += 1
+                return key
+            if not self._can_force_refresh():
+                self.misses += 1
+                return None
+
+        self.misses += 1
+        try:
+            self.refresh(kid)
+        except Exception:
+            # Keep serving the last known keys if Auth0 is unreachable,
+            # and back off instead of retrying on every request.
+            if not self._keys:
+                raise
+            self._expires_at = time.monotonic() + self.min_refresh_interval
+        return self._keys.get(kid)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'keys': len(self._keys),
+        }
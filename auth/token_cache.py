@@ -0,0 +1,74 @@
+import hashlib
+import json
+import time
+
+from lru import ByteLRU
+
+
+'''
+VerifiedTokenCache
+    A bounded LRU cache of decoded JWT payloads.
+    Entries are keyed by the SHA-256 digest of the raw token, so the
+    bearer tokens themselves are never kept in memory. An entry expires
+    at the token's exp claim or max_ttl seconds after it was stored,
+    whichever comes first, and least recently used entries are evicted
+    once the estimated size of the cache exceeds max_bytes.
+    A max_bytes of 0 disables the cache.
+'''
+
+
+class VerifiedTokenCache:
+    def __init__(self, max_bytes=1024 * 1024, max_ttl=300):
+        self.max_bytes = max_bytes
+        self.max_ttl = max_ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        # wall clock, to compare with the exp claims
+        self._entries = ByteLRU(max_bytes, clock=time.time)
+
+    @property
+    def size(self):
+        return self._entries.size
+
+    @staticmethod
+    def digest(token):
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        return hashlib.sha256(token).digest()
+
+    def get(self, token):
+        if not self.max_bytes:
+            return None
+        payload = self._entries.get(self.digest(token))
+        if payload is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return payload
+
+    def put(self, token, payload):
+        if not self.max_bytes:
+            return
+        expires_at = time.time() + self.max_ttl
+        exp = payload.get('exp')
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        if expires_at <= time.time():
+            return
+
+        size = len(json.dumps(payload, default=str))
+        self._entries.put(self.digest(token), payload, size, expires_at)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self._entries.evictions,
+            'entries': len(self._entries),
+            'bytes': self._entries.size,
+        }
@@ -0,0 +1,409 @@
+'''
+benchmark.py
+    a reproducible load benchmark of the API
+    seeds a database with N movies and M actors, serves the app on a
+    local port and drives every route at a fixed concurrency, then
+    reports throughput, latency percentiles and SQL statements per
+    request for each route as JSON
+
+    runs fully offline: tokens are signed with a throwaway RSA key and
+    verified against a local JWKS file instead of Auth0
+
+    usage:
+        python benchmark.py --movies 1000 --actors 5000 \\
+            --requests 500 --concurrency 8 --output bench.json
+        DATABASE_URL=postgresql://localhost/bench python benchmark.py --reset
+'''
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GENDERS = ('female', 'male', 'other')
+
+
+'''
+Scenario
+    one benchmarked route: the role whose token is sent and a
+    build(i, rng) callable returning the (path, body) of the i-th request
+    the body is sent as JSON, or as is with any other content_type
+'''
+
+
+class Scenario:
+    def __init__(self, name, method, role, build,
+                 content_type='application/json'):
+        self.name = name
+        self.method = method
+        self.role = role
+        self.build = build
+        self.content_type = content_type
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Load benchmark of the casting agency API.')
+    parser.add_argument('--movies', type=int, default=1000,
+                        help='movies to seed (default 1000)')
+    parser.add_argument('--actors', type=int, default=5000,
+                        help='actors to seed (default 5000)')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per route (default 200)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='concurrent clients (default 8)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed of the data and requests')
+    parser.add_argument('--database', default=os.environ.get(
+        'DATABASE_URL', 'sqlite://'),
+        help='database url (default $DATABASE_URL or in-memory SQLite)')
+    parser.add_argument('--reset', action='store_true',
+                        help='drop and recreate the tables before seeding')
+    parser.add_argument('--routes', default=None,
+                        help='comma separated scenario names to run')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='disable the response cache')
+    parser.add_argument('--output', default=None,
+                        help='write the JSON report here instead of stdout')
+    return parser.parse_args(argv)
+
+
+def seed(db, Movie, Actor, movies, actors, rng, batch_size):
+    start = datetime(1950, 1, 1)
+    movie_ids = []
+    for offset in range(0, movies, batch_size):
+        movie_ids += Movie.insert_many([
+            {'title': 'Movie %d' % (offset + i),
+             'release_date': start + timedelta(days=rng.randrange(27000))}
+            for i in range(min(batch_size, movies - offset))])
+
+    actor_ids = []
+    for offset in range(0, actors, batch_size):
+        actor_ids += Actor.insert_many([
+            {'name': 'Actor %d' % (offset + i),
+             'age': rng.randrange(18, 90),
+             'gender': rng.choice(GENDERS),
+             'movie_id': rng.choice(movie_ids) if movie_ids else None}
+            for i in range(min(batch_size, actors - offset))])
+    return movie_ids, actor_ids
+
+
+'''
+scenarios(movie_ids, actor_ids)
+    every route of create_app with realistic arguments; deletes run
+    last, single ones taking distinct rows from the end of the seeded
+    ids, then bulk ones from the start (ids already gone are reported
+    as not found, not as errors)
+'''
+
+
+def scenarios(movie_ids, actor_ids):
+    def some(ids, rng):
+        return rng.choice(ids) if ids else 1
+
+    def last(ids, i):
+        return ids[-(i + 1)] if i < len(ids) else 0
+
+    def first(ids, i, n):
+        return ids[i * n:(i + 1) * n] or [0]
+
+    def movie(i, rng):
+        return {'title': 'Benchmark movie %d' % i,
+                'release_date': '2020-01-%02d' % (i % 28 + 1)}
+
+    def actor(i, rng):
+        return {'name': 'Benchmark actor %d' % i, 'age': rng.randrange(18, 90),
+                'gender': rng.choice(GENDERS), 'movie_id': some(movie_ids, rng)}
+
+    def movies_ndjson(i, rng):
+        return ''.join(json.dumps(movie(i * 100 + j, rng)) + '\n'
+                       for j in range(100))
+
+    def actors_csv(i, rng):
+        return 'name,age,gender,movie_id\n' + ''.join(
+            '%(name)s,%(age)d,%(gender)s,%(movie_id)d\n' % actor(i * 100 + j, rng)
+            for j in range(100))
+
+    return [
+        Scenario('greeting', 'GET', None,
+                 lambda i, rng: ('/', None)),
+        Scenario('health_pool', 'GET', None,
+                 lambda i, rng: ('/health/pool', None)),
+        Scenario('metrics', 'GET', None,
+                 lambda i, rng: ('/metrics', None)),
+        Scenario('list_movies', 'GET', 'casting_assistant',
+                 lambda i, rng: ('/movies?limit=50&after=%d'
+                                 % some(movie_ids, rng), None)),
+        Scenario('list_actors', 'GET', 'casting_assistant',
+                 lambda i, rng: ('/actors?limit=50&after=%d'
+                                 % some(actor_ids, rng), None)),
+        Scenario('filter_actors', 'GET', 'casting_assistant',
+                 lambda i, rng: ('/actors?gender=%s&age[gte]=%d&sort=-age'
+                                 % (rng.choice(GENDERS), rng.randrange(18, 90)),
+                                 None)),
+        Scenario('stream_actors', 'GET', 'casting_assistant',
+                 lambda i, rng: ('/actors?stream=true&movie_id=%d'
+                                 % some(movie_ids, rng), None)),
+        Scenario('export_movies', 'GET', 'casting_assistant',
+                 lambda i, rng: ('/export/movies', None)),
+        Scenario('export_actors', 'GET', 'casting_assistant',
+                 lambda i, rng: ('/export/actors', None)),
+        Scenario('export_cast', 'GET', 'casting_assistant',
+                 lambda i, rng: ('/export/cast?format=csv', None)),
+        Scenario('create_movie', 'POST', 'executive_producer',
+                 lambda i, rng: ('/movies', movie(i, rng))),
+        Scenario('create_actor', 'POST', 'casting_director',
+                 lambda i, rng: ('/actors', actor(i, rng))),
+        Scenario('create_movies_batch', 'POST', 'executive_producer',
+                 lambda i, rng: ('/movies/batch',
+                                 [movie(i * 100 + j, rng) for j in range(100)])),
+        Scenario('create_actors_batch', 'POST', 'casting_director',
+                 lambda i, rng: ('/actors/batch',
+                                 [actor(i * 100 + j, rng) for j in range(100)])),
+        Scenario('import_movies', 'POST', 'executive_producer',
+                 lambda i, rng: ('/import/movies', movies_ndjson(i, rng)),
+                 content_type='application/x-ndjson'),
+        Scenario('import_actors', 'POST', 'casting_director',
+                 lambda i, rng: ('/import/actors', actors_csv(i, rng)),
+                 content_type='text/csv'),
+        Scenario('update_movie', 'PATCH', 'casting_director',
+                 lambda i, rng: ('/movies/%d' % some(movie_ids, rng),
+                                 {'title': 'Updated movie %d' % i})),
+        Scenario('update_actor', 'PATCH', 'casting_director',
+                 lambda i, rng: ('/actors/%d' % some(actor_ids, rng),
+                                 {'age': rng.randrange(18, 90)})),
+        Scenario('assign_actors', 'PATCH', 'casting_director',
+                 lambda i, rng: ('/actors/batch', {
+                     'ids': rng.sample(actor_ids, min(20, len(actor_ids))),
+                     'movie_id': some(movie_ids, rng)})),
+        Scenario('delete_actor', 'DELETE', 'casting_director',
+                 lambda i, rng: ('/actors/%d' % last(actor_ids, i), None)),
+        Scenario('delete_movie', 'DELETE', 'executive_producer',
+                 lambda i, rng: ('/movies/%d' % last(movie_ids, i), None)),
+        Scenario('delete_actors_batch', 'DELETE', 'casting_director',
+                 lambda i, rng: ('/actors/batch',
+                                 {'ids': first(actor_ids, i, 5)})),
+        Scenario('delete_movies_batch', 'DELETE', 'executive_producer',
+                 lambda i, rng: ('/movies/batch',
+                                 {'ids': first(movie_ids, i, 2)})),
+    ]
+
+
+'''
+serialized(wsgi_app)
+    runs one request at a time: an in-memory SQLite database is a single
+    connection shared by every thread, which cannot hold concurrent
+    transactions
+'''
+
+
+def serialized(wsgi_app):
+    lock = threading.Lock()
+
+    def app(environ, start_response):
+        with lock:
+            iterable = wsgi_app(environ, start_response)
+            try:
+                return [b''.join(iterable)]
+            finally:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+    return app
+
+
+def send(base_url, method, path, body, headers,
+         content_type='application/json'):
+    data = None
+    if body is not None:
+        if content_type == 'application/json':
+            body = json.dumps(body)
+        data = body.encode('utf-8')
+        headers = dict(headers, **{'Content-Type': content_type})
+    request = Request(base_url + path, data=data, headers=headers,
+                      method=method)
+    start = time.perf_counter()
+    try:
+        with urlopen(request) as response:
+            response.read()
+            status = response.status
+    except HTTPError as error:
+        error.read()
+        status = error.code
+    return status, time.perf_counter() - start
+
+
+def percentile(latencies, p):
+    # nearest-rank percentile of sorted latencies
+    if not latencies:
+        return None
+    rank = max(int(round(p / 100.0 * len(latencies) + 0.5)) - 1, 0)
+    return latencies[min(rank, len(latencies) - 1)]
+
+
+def run_scenario(base_url, scenario, tokens, count, concurrency, rng,
+                 query_counts):
+    headers = {'X-Benchmark-Scenario': scenario.name}
+    if scenario.role is not None:
+        headers['Authorization'] = 'Bearer %s' % tokens[scenario.role]
+    prepared = [scenario.build(i, rng) for i in range(count)]
+
+    query_counts[scenario.name] = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(
+            lambda request: send(base_url, scenario.method, request[0],
+                                 request[1], headers, scenario.content_type),
+            prepared))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for status, latency in results)
+    statuses = {}
+    for status, latency in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    queries = query_counts[scenario.name]
+
+    def ms(seconds):
+        return round(seconds * 1000, 3) if seconds is not None else None
+
+    return {
+        'route': scenario.name,
+        'method': scenario.method,
+        'requests': count,
+        'errors': sum(1 for status, latency in results if status >= 400),
+        'statuses': statuses,
+        'seconds': round(elapsed, 3),
+        'rps': round(count / elapsed, 1) if elapsed else None,
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'queries_per_request': round(sum(queries) / len(queries), 2)
+        if queries else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+
+    # the app reads these at import time
+    os.environ['DATABASE_URL'] = args.database
+    os.environ.setdefault('AUTH0_DOMAIN', 'benchmark.local')
+    os.environ.setdefault('ALGORITHMS', 'RS256')
+    os.environ.setdefault('API_AUDIENCE', 'casting')
+
+    from flask import g, request
+    from werkzeug.serving import make_server
+
+    from app import create_app
+    from auth.auth import JWT_DECODE_OPTIONS, jwks_store
+    from auth.issuer import LocalIssuer, load_roles
+    from models import db, Movie, Actor
+
+    # the key store fetches the issuer's JWKS from a file, like it
+    # would from Auth0
+    issuer = LocalIssuer.generate(JWT_DECODE_OPTIONS['issuer'],
+                                  JWT_DECODE_OPTIONS['audience'])
+    jwks_store.url = issuer.write_jwks(
+        os.path.join(tempfile.mkdtemp(prefix='benchmark-'), 'jwks.json'))
+    tokens = {role: issuer.mint_role(role) for role in load_roles()}
+
+    config = {'SQL_QUERY_BUDGET': 0}
+    if args.no_cache:
+        config['RESPONSE_CACHE_BACKEND'] = 'none'
+    app = create_app(config)
+
+    query_counts = {}
+
+    @app.teardown_request
+    def count_request_queries(exc):
+        # teardown also runs after a streamed body is sent
+        name = request.headers.get('X-Benchmark-Scenario')
+        counter = g.get('query_counter', None)
+        if name in query_counts and counter is not None:
+            query_counts[name].append(counter.count)
+
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+        db.create_all()
+        movie_ids, actor_ids = seed(db, Movie, Actor, args.movies,
+                                    args.actors, rng,
+                                    app.config['BATCH_MAX_SIZE'])
+        dialect = db.engine.dialect.name
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    serialize = args.database.rstrip('/') in ('sqlite:', 'sqlite:/:memory:')
+    server = make_server('127.0.0.1', 0,
+                         serialized(app) if serialize else app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = 'http://127.0.0.1:%d' % server.server_port
+
+    selected = args.routes.split(',') if args.routes else None
+    results = []
+    try:
+        # fetch the JWKS and verify each token once before measuring
+        for token in tokens.values():
+            send(base_url, 'GET', '/movies?limit=1', None,
+                 {'Authorization': 'Bearer %s' % token})
+        for scenario in scenarios(movie_ids, actor_ids):
+            if selected is not None and scenario.name not in selected:
+                continue
+            result = run_scenario(base_url, scenario, tokens, args.requests,
+                                  args.concurrency, rng, query_counts)
+            results.append(result)
+            print('%-20s %8.1f rps  p50 %8.2f ms  p95 %8.2f ms  '
+                  'p99 %8.2f ms  %5s queries  %d errors'
+                  % (result['route'], result['rps'], result['p50_ms'],
+                     result['p95_ms'], result['p99_ms'],
+                     result['queries_per_request'], result['errors']),
+                  file=sys.stderr)
+    finally:
+        server.shutdown()
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'database': dialect,
+        'movies': args.movies,
+        'actors': args.actors,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'seed': args.seed,
+        'response_cache': not args.no_cache,
+        'serialized': serialize,
+        'routes': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+
+from flask import abort, current_app, request
+
+from json_provider import jsonify
+from models import db, commit_writes
+
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+# rejected rows listed in the response of the import endpoints
+ERRORS_SHOWN = 100
+
+
+'''
+read_records(lines, fmt)
+    yields (line number, record) for every row of a CSV file (with a
+    header row) or an NDJSON file, read lazily from an iterable of text
+    lines; the record is None for a line that is not a JSON object
+'''
+
+
+def read_records(lines, fmt):
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    if fmt != 'ndjson':
+        raise ValueError('unknown import format %r' % fmt)
+
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield number, record if isinstance(record, dict) else None
+
+
+def _coerce(column, value):
+    python_type = column.type.python_type
+    if python_type is int:
+        if isinstance(value, bool):
+            raise ValueError
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError
+        if isinstance(value, str):
+            value = value.strip()
+        return int(value)
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError
+    return value
+
+
+'''
+validate_record(model, fields, record)
+    checks a record against the columns of model, as create_movie and
+    create_actor would: every one of fields is required (an empty CSV
+    cell counts as missing), integers may be given as strings and dates
+    as ISO-8601 strings; other keys are ignored
+    returns (values, errors), errors being {field: message}
+'''
+
+
+def validate_record(model, fields, record):
+    if record is None:
+        return None, {'record': 'not a JSON object'}
+
+    values, errors = {}, {}
+    for field in fields:
+        value = record.get(field)
+        if value is None or value == '':
+            errors[field] = 'missing'
+            continue
+        column = model.__table__.c[field]
+        try:
+            values[field] = _coerce(column, value)
+        except (TypeError, ValueError):
+            errors[field] = 'not a valid %s' % column.type.python_type.__name__
+    return values, errors
+
+
+'''
+ImportResult
+    counts of an import: rows read, rows that failed validation (or
+    reference a missing row), rows loaded into the staging table, rows
+    inserted, and rows skipped by a dedupe import
+'''
+
+
+class ImportResult:
+    def __init__(self):
+        self.read = 0
+        self.errors = 0
+        self.loaded = 0
+        self.inserted = 0
+        self.skipped = 0
+
+    def as_dict(self):
+        return {'read': self.read, 'errors': self.errors,
+                'loaded': self.loaded, 'inserted': self.inserted,
+                'skipped': self.skipped}
+
+
+def staging_table(model, fields):
+    columns = [db.Column('line', db.Integer, primary_key=True,
+                         autoincrement=False)]
+    columns += [db.Column(field, model.__table__.c[field].type)
+                for field in fields]
+    return db.Table('import_%s' % model.__tablename__, db.MetaData(),
+                    *columns, prefixes=['TEMPORARY'])
+
+
+def _copy_rows(connection, staging, rows):
+    names = [column.name for column in staging.columns]
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(
+        [row[name] for name in names] for row in rows)
+    buffer.seek(0)
+
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert('COPY %s (%s) FROM STDIN WITH (FORMAT csv)'
+                           % (staging.name, ', '.join(names)), buffer)
+    finally:
+        cursor.close()
+
+
+def _reject_dangling(connection, model, fields, staging, on_error):
+    table = model.__table__
+    rejected = 0
+    for field in fields:
+        for key in table.c[field].foreign_keys:
+            target = key.column
+            dangling = (staging.c[field].isnot(None)
+                        & ~db.select([target])
+                        .where(target == staging.c[field]).exists())
+            for row in connection.execute(
+                    db.select([staging]).where(dangling)
+                    .order_by(staging.c.line)):
+                record = dict(row._mapping)
+                if on_error is not None:
+                    on_error(record.pop('line'), {field: 'does not exist'},
+                             record)
+                rejected += 1
+            connection.execute(staging.delete().where(dangling))
+    return rejected
+
+
+def _merge(connection, model, fields, staging, dedupe=False):
+    table = model.__table__
+    if not dedupe:
+        rows = (db.select([staging.c[field] for field in fields])
+                .order_by(staging.c.line))
+        return connection.execute(
+            table.insert().from_select(fields, rows)).rowcount
+
+    # NULLs count as equal, both within the file (as in PARTITION BY)
+    # and against the table
+    columns = [staging.c[field] for field in fields]
+    ranked = db.select(
+        [staging.c.line] + columns +
+        [db.func.row_number().over(partition_by=columns,
+                                   order_by=staging.c.line).label('rank')]
+    ).subquery()
+    existing = db.select([table.c.id]).where(
+        *[table.c[field].is_not_distinct_from(ranked.c[field])
+          for field in fields]).exists()
+    rows = (db.select([ranked.c[field] for field in fields])
+            .where(ranked.c.rank == 1, ~existing)
+            .order_by(ranked.c.line))
+    return connection.execute(table.insert().from_select(fields, rows)).rowcount
+
+
+'''
+import_records(model, fields, lines, fmt, batch_size=None, on_error=None,
+               progress=None, dedupe=False)
+    bulk loads a CSV or NDJSON file (see read_records) into the table
+    of model, in a single transaction:
+    - the rows are validated (see validate_record) and loaded into a
+      temporary staging table in batches of batch_size
+      (IMPORT_BATCH_SIZE by default), with COPY on Postgres and an
+      executemany INSERT elsewhere, so the file is never held in memory
+    - rows that reference a missing row (e.g. an unknown movie_id) are
+      rejected
+    - one INSERT ... SELECT copies every staged row into the model's
+      table, in file order; with dedupe, rows equal in every field to
+      one already in the table or to an earlier line are skipped
+      instead (two actors may share a name, age and gender, so this is
+      off by default)
+    on_error(line, errors, record) is called for every rejected row
+    and progress(result) after every batch
+    returns an ImportResult
+'''
+
+
+def import_records(model, fields, lines, fmt, batch_size=None,
+                   on_error=None, progress=None, dedupe=False):
+    batch_size = batch_size or current_app.config['IMPORT_BATCH_SIZE']
+    result = ImportResult()
+    staging = staging_table(model, fields)
+    connection = db.session.connection()
+
+    def flush(batch):
+        if connection.dialect.name == 'postgresql':
+            _copy_rows(connection, staging, batch)
+        else:
+            connection.execute(staging.insert(), batch)
+        result.loaded += len(batch)
+        if progress is not None:
+            progress(result)
+
+    try:
+        staging.drop(connection, checkfirst=True)
+        staging.create(connection)
+
+        batch = []
+        for line, record in read_records(lines, fmt):
+            result.read += 1
+            values, errors = validate_record(model, fields, record)
+            if errors:
+                result.errors += 1
+                if on_error is not None:
+                    on_error(line, errors, record)
+                continue
+            values['line'] = line
+            batch.append(values)
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+
+        rejected = _reject_dangling(connection, model, fields, staging,
+                                    on_error)
+        result.errors += rejected
+        result.inserted = _merge(connection, model, fields, staging, dedupe)
+        result.skipped = result.loaded - rejected - result.inserted
+        staging.drop(connection)
+        commit_writes(model.invalidates)
+    except BaseException:
+        db.session.rollback()
+        raise
+    return result
+
+
+'''
+import_request(model, fields)
+    imports the body of the request with import_records: CSV when
+    ?format=csv or the Content-Type is text/csv, NDJSON otherwise,
+    gunzipped first with `Content-Encoding: gzip`; ?dedupe=true skips
+    the rows the table already has
+    returns the counts of the ImportResult and the first ERRORS_SHOWN
+    rejected rows
+'''
+
+
+def import_request(model, fields):
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+    if fmt not in IMPORT_FORMATS:
+        abort(400)
+
+    stream = request.stream
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        stream = gzip.GzipFile(fileobj=stream)
+    lines = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+    errors = []
+
+    def on_error(line, messages, record):
+        if len(errors) < ERRORS_SHOWN:
+            errors.append({'line': line, 'errors': messages})
+
+    dedupe = request.args.get('dedupe', '').lower() in ('1', 'true', 'yes')
+    try:
+        result = import_records(model, fields, lines, fmt, on_error=on_error,
+                                dedupe=dedupe)
+    except (UnicodeDecodeError, OSError, csv.Error):
+        abort(400)
+    except:
+        abort(422)
+
+    return jsonify(dict(result.as_dict(), success=True, rejected=errors))
@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+
+'''
+TimedQueuePool
+    a QueuePool that records how long callers wait to check out a
+    connection (including the time to open a new one), so the pool can
+    be sized from data instead of guesswork
+'''
+
+
+class TimedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wait_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            # only an exhausted pool; a refused connection is not a wait
+            with self._wait_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._wait_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    def recreate(self):
+        # keep the statistics when the pool is recreated (e.g. on dispose)
+        pool = super().recreate()
+        pool.checkouts = self.checkouts
+        pool.wait_total = self.wait_total
+        pool.wait_max = self.wait_max
+        pool.timeouts = self.timeouts
+        return pool
+
+
+'''
+engine_options(database_path)
+    SQLALCHEMY_ENGINE_OPTIONS for a database url, read from the
+    environment:
+        DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (seconds),
+        DB_POOL_RECYCLE (seconds), DB_POOL_PRE_PING (true/false),
+        DB_STATEMENT_TIMEOUT (milliseconds, PostgreSQL only, 0 = none)
+    SQLite urls get no pool options, Flask-SQLAlchemy picks its pool
+'''
+
+
+def engine_options(database_path):
+    if database_path.startswith('sqlite'):
+        return {}
+
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get(
+            'DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes'),
+    }
+
+    statement_timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT', 0))
+    if statement_timeout and database_path.startswith('postgresql'):
+        options['connect_args'] = {
+            'options': '-c statement_timeout=%d' % statement_timeout
+        }
+
+    return options
+
+
+'''
+pool_stats(engine)
+    a snapshot of the engine's connection pool: configured size, open,
+    checked out and overflow connections, and checkout waits in seconds
+'''
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {'class': type(pool).__name__}
+
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': pool._max_overflow,
+        })
+
+    if isinstance(pool, TimedQueuePool):
+        stats.update({
+            'checkouts': pool.checkouts,
+            'timeouts': pool.timeouts,
+            'wait_total': round(pool.wait_total, 6),
+            'wait_avg': round(pool.wait_total / pool.checkouts, 6)
+            if pool.checkouts else 0.0,
+            'wait_max': round(pool.wait_max, 6),
+        })
+
+    return stats
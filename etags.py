@@ -0,0 +1,77 @@
+import hashlib
+
+from flask import abort, request, make_response
+
+from models import get_row_version, get_version
+
+
+'''
+collection_etag(name)
+    a weak ETag for the response to the current request on a collection:
+    the collection's version plus a digest of the query string, since
+    every page, filter and sort is its own representation
+'''
+
+
+def collection_etag(name):
+    query = hashlib.sha1(request.query_string).hexdigest()[:16]
+    return '%s-%s-%s' % (name, get_version(name), query)
+
+
+'''
+not_modified(etag)
+    a 304 response if the client's If-None-Match already has this ETag,
+    None otherwise
+'''
+
+
+def not_modified(etag):
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = make_response('', 304)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+'''
+get_expected_versions(body=None)
+    the versions a PATCH or DELETE may apply to, from the If-Match
+    header (the ETags returned by PATCH are the row's version) and a
+    `version` in the JSON body; None when the request sets neither or
+    sends If-Match: *
+    aborts with 400 if the body's version is not an integer
+'''
+
+
+def get_expected_versions(body=None):
+    versions = None
+    if request.if_match and not request.if_match.star_tag:
+        versions = set()
+        for tag in request.if_match.as_set():
+            if tag.isdigit():
+                versions.add(int(tag))
+
+    if isinstance(body, dict) and 'version' in body:
+        version = body['version']
+        if not isinstance(version, int) or isinstance(version, bool):
+            abort(400)
+        versions = {version} if versions is None else versions & {version}
+
+    return versions
+
+
+'''
+abort_failed_write(model, id)
+    explains why a conditional PATCH or DELETE matched no row: 404 if
+    the row does not exist, 412 if its version is not one of If-Match,
+    409 if it differs from the version in the body
+'''
+
+
+def abort_failed_write(model, id):
+    version = get_row_version(model, id)
+    if version is None:
+        abort(404)
+    if request.if_match and not request.if_match.contains(str(version)):
+        abort(412)
+    abort(409)
@@ -0,0 +1,128 @@
+import csv
+import io
+import zlib
+
+from flask import (Response, abort, current_app, request,
+                   stream_with_context)
+
+from json_provider import dumps
+from models import db, Movie, Actor
+
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+'''
+export_select(kind)
+    the SELECT of an export, in id order: 'movies' and 'actors' read
+    the columns the list endpoints return, 'cast' reads every actor
+    with the title and release date of their movie (null when the
+    actor has no movie)
+'''
+
+
+def export_select(kind):
+    movies = Movie.__table__
+    actors = Actor.__table__
+    if kind == 'movies':
+        columns = [movies.c[name] for name in Movie.row_columns]
+        return db.select(columns).order_by(movies.c.id)
+    if kind == 'actors':
+        columns = [actors.c[name] for name in Actor.row_columns]
+        return db.select(columns).order_by(actors.c.id)
+    if kind == 'cast':
+        columns = [actors.c.id.label('actor_id'), actors.c.name,
+                   actors.c.age, actors.c.gender, actors.c.movie_id,
+                   movies.c.title.label('movie_title'),
+                   movies.c.release_date.label('movie_release_date')]
+        return (db.select(columns)
+                .select_from(actors.outerjoin(movies))
+                .order_by(actors.c.id))
+    raise ValueError('unknown export %r' % kind)
+
+
+def _encode_ndjson(keys, rows):
+    return ''.join(dumps(dict(zip(keys, row))) + '\n' for row in rows)
+
+
+def _encode_csv(keys, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(
+        ['' if value is None else
+         value.isoformat() if hasattr(value, 'isoformat') else value
+         for value in row] for row in rows)
+    return buffer.getvalue()
+
+
+'''
+export_chunks(kind, fmt, batch_size=None)
+    yields the export as text, one chunk per batch of batch_size rows
+    (STREAM_BATCH_SIZE by default) read from a server-side cursor, so
+    memory use does not grow with the size of the catalog
+    fmt is 'ndjson' (one JSON object per line) or 'csv' (with a header
+    row); dates are written as ISO-8601 in both
+'''
+
+
+def export_chunks(kind, fmt, batch_size=None):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError('unknown export format %r' % fmt)
+    batch_size = batch_size or current_app.config['STREAM_BATCH_SIZE']
+    encode = _encode_ndjson if fmt == 'ndjson' else _encode_csv
+
+    result = db.session.execute(
+        export_select(kind).execution_options(stream_results=True))
+    keys = list(result.keys())
+    if fmt == 'csv':
+        yield _encode_csv(keys, [keys])
+    for rows in result.partitions(batch_size):
+        yield encode(keys, rows)
+
+
+'''
+gzip_chunks(chunks)
+    compresses text chunks into a gzip stream as they come
+'''
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _accepts_gzip():
+    if request.args.get('gzip', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return 'gzip' in request.headers.get('Accept-Encoding', '').lower()
+
+
+'''
+export_response(kind)
+    streams export_chunks(kind, ?format=) as an attachment, gzipped on
+    the fly when the client sends `Accept-Encoding: gzip` or ?gzip=true
+'''
+
+
+def export_response(kind):
+    fmt = request.args.get('format', 'ndjson').lower()
+    if fmt not in EXPORT_FORMATS:
+        abort(400)
+
+    chunks = export_chunks(kind, fmt)
+    headers = {
+        'Content-Disposition': 'attachment; filename=%s.%s' % (kind, fmt),
+        'Vary': 'Accept-Encoding',
+    }
+    if _accepts_gzip():
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+
+    return Response(stream_with_context(chunks),
+                    mimetype=EXPORT_FORMATS[fmt], headers=headers)
@@ -0,0 +1,48 @@
+from flask import request, abort
+
+
+'''
+get_fieldset_args(model, sort=None)
+    parses the sparse fieldset parameters of a list request, e.g.
+        ?fields=title,release_date&include=actors
+    fields are names of model.row_columns, include names of
+    model.includes (the relationships a response can embed); id is
+    always returned
+    without either parameter the response keeps its full shape: every
+    column and every include; with fields alone nothing is embedded
+    aborts with 400 on an unknown or empty field, or an unknown include
+    returns (columns, fields, include): the columns to SELECT (the
+    fields plus id and the sort column, which the next cursor needs),
+    the fields to serialize (None for all) and the includes
+'''
+
+
+def get_fieldset_args(model, sort=None):
+    fields = None
+    if 'fields' in request.args:
+        fields = _split(request.args['fields'])
+        if not fields or any(name not in model.row_columns for name in fields):
+            abort(400)
+        fields = ['id'] + [name for name in model.row_columns
+                           if name in fields and name != 'id']
+
+    if 'include' in request.args:
+        include = tuple(_split(request.args['include']))
+        if any(name not in model.includes for name in include):
+            abort(400)
+    elif fields is None:
+        include = model.includes
+    else:
+        include = ()
+
+    if fields is None:
+        return model.row_columns, None, include
+
+    columns = list(fields)
+    if sort and sort.lstrip('-') not in columns:
+        columns.append(sort.lstrip('-'))
+    return tuple(columns), tuple(fields), include
+
+
+def _split(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
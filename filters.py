@@ -0,0 +1,90 @@
+import datetime
+import operator
+import re
+
+from flask import request, abort
+
+
+# query parameters that are not column filters
+RESERVED_PARAMS = {'limit', 'after', 'stream', 'sort', 'fields', 'include'}
+
+OPERATORS = {
+    'eq': operator.eq,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+}
+
+# `age`, `age[gte]`, ...
+_PARAM_RE = re.compile(r'^(\w+)(?:\[(\w+)\])?$')
+
+
+'''
+indexed_columns(model)
+    the columns of a model that can be filtered and sorted on:
+    only indexed ones, so every filter stays an index scan
+'''
+
+
+def indexed_columns(model):
+    return {column.name: column for column in model.__table__.columns
+            if column.index or column.primary_key}
+
+
+'''
+parse_value(column, value)
+    converts a query string value to the python type of the column
+    raises ValueError if it does not fit
+'''
+
+
+def parse_value(column, value):
+    if column.type.python_type is int:
+        return int(value)
+    if column.type.python_type is datetime.datetime:
+        return datetime.datetime.fromisoformat(value)
+    return value
+
+
+'''
+get_filter_args(model)
+    compiles the filter and sort parameters of the current request
+    into SQL criteria and a sort key for the given model, e.g.
+        ?gender=F&age[gte]=20&age[lt]=30&sort=-age
+    filters are `<column>=<value>` or `<column>[<op>]=<value>` with op
+    one of eq, gt, gte, lt, lte; sort is a column name, prefixed with
+    `-` for descending order
+    aborts with 400 on an unknown parameter, a column that is not
+    indexed, an unknown operator or a value of the wrong type
+    returns the list of criteria and the sort key (None for id order)
+'''
+
+
+def get_filter_args(model):
+    columns = indexed_columns(model)
+    criteria = []
+
+    for param, values in request.args.lists():
+        if param in RESERVED_PARAMS:
+            continue
+
+        match = _PARAM_RE.match(param)
+        if match is None:
+            abort(400)
+        name, op = match.group(1), match.group(2) or 'eq'
+        if name not in columns or op not in OPERATORS:
+            abort(400)
+
+        for value in values:
+            try:
+                value = parse_value(columns[name], value)
+            except ValueError:
+                abort(400)
+            criteria.append(OPERATORS[op](getattr(model, name), value))
+
+    sort = request.args.get('sort', None)
+    if sort is not None and sort.lstrip('-') not in columns:
+        abort(400)
+
+    return criteria, sort
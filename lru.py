@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Rough per-entry bookkeeping cost (key, tuple, dict slot) in bytes.
+ENTRY_OVERHEAD = 200
+
+
+'''
+ByteLRU
+    A thread-safe LRU of expiring entries, bounded by their estimated
+    size in bytes rather than by their number: once the sizes given to
+    put() (plus ENTRY_OVERHEAD each) exceed max_bytes, the least
+    recently used entries are evicted. Expiry times are read from
+    clock, time.monotonic by default.
+'''
+
+
+class ByteLRU:
+    def __init__(self, max_bytes, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.size = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value, size = entry
+            if self.clock() >= expires_at:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, size, expires_at):
+        # returns False when the entry alone is larger than the cache
+        size += ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return True
+
+    def _remove(self, key):
+        expires_at, value, size = self._entries.pop(key)
+        self.size -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
@@ -0,0 +1,138 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request
+
+
+# Prometheus' default latency buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75,
+           1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+'''
+Histogram
+    cumulative latency histograms per (route, phase), in the shape
+    Prometheus expects; kept per worker process
+'''
+
+
+class Histogram:
+    def __init__(self, name, description, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.description),
+                 '# TYPE %s histogram' % self.name]
+        with self._lock:
+            series = sorted((labels, list(counts), total, count)
+                            for labels, (counts, total, count)
+                            in self._series.items())
+        for (route, phase), counts, total, count in series:
+            labels = 'route="%s",phase="%s"' % (route, phase)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append('%s_bucket{%s,le="%s"} %d'
+                             % (self.name, labels, bound, cumulative))
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (self.name, labels, count))
+            lines.append('%s_sum{%s} %.6f' % (self.name, labels, total))
+            lines.append('%s_count{%s} %d' % (self.name, labels, count))
+        return lines
+
+
+request_phase_seconds = Histogram(
+    'http_request_phase_seconds',
+    'Time spent per route in each phase of handling a request.')
+
+
+'''
+timed(phase)
+    times the enclosed block as one phase of the current request,
+    e.g. `with timed('db'): ...`; repeated phases add up
+    outside of a request, or with METRICS_ENABLED off, it only runs
+    the block
+'''
+
+
+@contextmanager
+def timed(phase):
+    timings = g.get('phase_timings', None) if has_app_context() else None
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start
+
+
+def _start_timer():
+    g.request_start = time.perf_counter()
+    g.phase_timings = {}
+
+
+def _record_timings(response):
+    timings = g.get('phase_timings', None)
+    if timings is None:
+        return response
+    timings['total'] = time.perf_counter() - g.request_start
+
+    route = '%s %s' % (request.method,
+                       request.url_rule.rule if request.url_rule else 'unmatched')
+    for phase, seconds in timings.items():
+        request_phase_seconds.observe((route, phase), seconds)
+
+    response.headers['Server-Timing'] = ', '.join(
+        '%s;dur=%.2f' % (phase, seconds * 1000)
+        for phase, seconds in timings.items())
+    return response
+
+
+'''
+init_metrics(app)
+    times every request when METRICS_ENABLED is set: phases measured
+    with timed() plus the total are sent back in a Server-Timing header
+    and aggregated into request_phase_seconds
+'''
+
+
+def init_metrics(app):
+    if not app.config['METRICS_ENABLED']:
+        return
+    app.before_request(_start_timer)
+    app.after_request(_record_timings)
+
+
+'''
+render_metrics(samples)
+    the Prometheus text exposition of the histograms plus the given
+    {(name, description, type): value} samples
+'''
+
+
+def render_metrics(samples=None):
+    lines = request_phase_seconds.render()
+    for (name, description, kind), value in sorted((samples or {}).items()):
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, kind))
+        lines.append('%s %s' % (name, value))
+    return '\n'.join(lines) + '\n'
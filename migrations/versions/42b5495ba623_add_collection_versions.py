@@ -0,0 +1,37 @@
+"""add collection versions
+
+Revision ID: 42b5495ba623
+Revises: a9f846a58d1d
+Create Date: 2026-10-18 13:27:05.160284
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '42b5495ba623'
+down_revision = 'a9f846a58d1d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'collection_versions' in inspector.get_table_names():
+        return
+
+    collection_versions = op.create_table(
+        'collection_versions',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(collection_versions, [
+        {'name': 'movies', 'version': 1},
+        {'name': 'actors', 'version': 1},
+    ])
+
+
+def downgrade():
+    op.drop_table('collection_versions')
@@ -0,0 +1,40 @@
+"""actors.movie_id on delete set null
+
+Revision ID: 7c3e9d2b5a41
+Revises: 42b5495ba623
+Create Date: 2026-10-18 15:12:48.530217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3e9d2b5a41'
+down_revision = '42b5495ba623'
+branch_labels = None
+depends_on = None
+
+
+def _replace_movie_fk(ondelete):
+    bind = op.get_bind()
+    # SQLite cannot alter constraints (nor enforces them by default);
+    # Movie.delete_by_id unassigns the actors itself there.
+    if bind.dialect.name == 'sqlite':
+        return
+
+    inspector = sa.inspect(bind)
+    for foreign_key in inspector.get_foreign_keys('actors'):
+        if foreign_key['constrained_columns'] == ['movie_id']:
+            op.drop_constraint(foreign_key['name'], 'actors',
+                               type_='foreignkey')
+    op.create_foreign_key('actors_movie_id_fkey', 'actors', 'movies',
+                          ['movie_id'], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    _replace_movie_fk('SET NULL')
+
+
+def downgrade():
+    _replace_movie_fk(None)
@@ -0,0 +1,31 @@
+"""add actor filter indexes
+
+Revision ID: a9f846a58d1d
+Revises: d1e1bd71ffbf
+Create Date: 2026-10-18 11:04:27.918342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9f846a58d1d'
+down_revision = 'd1e1bd71ffbf'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Tables created by db.create_all() may already have these.
+    inspector = sa.inspect(op.get_bind())
+    existing = [index['name'] for index in inspector.get_indexes('actors')]
+    if 'ix_actors_age' not in existing:
+        op.create_index('ix_actors_age', 'actors', ['age'], unique=False)
+    if 'ix_actors_gender' not in existing:
+        op.create_index('ix_actors_gender', 'actors', ['gender'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_actors_gender', table_name='actors')
+    op.drop_index('ix_actors_age', table_name='actors')
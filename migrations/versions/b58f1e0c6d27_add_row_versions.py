@@ -0,0 +1,31 @@
+"""add row versions
+
+Revision ID: b58f1e0c6d27
+Revises: 7c3e9d2b5a41
+Create Date: 2026-10-18 16:40:09.271846
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b58f1e0c6d27'
+down_revision = '7c3e9d2b5a41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Tables created by db.create_all() may already have them.
+    inspector = sa.inspect(op.get_bind())
+    for table in ('movies', 'actors'):
+        columns = [column['name'] for column in inspector.get_columns(table)]
+        if 'version' not in columns:
+            op.add_column(table, sa.Column('version', sa.Integer(),
+                                           nullable=False, server_default='1'))
+
+
+def downgrade():
+    op.drop_column('actors', 'version')
+    op.drop_column('movies', 'version')
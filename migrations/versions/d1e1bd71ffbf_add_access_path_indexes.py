@@ -0,0 +1,62 @@
+"""add access path indexes
+
+Revision ID: d1e1bd71ffbf
+Revises:
+Create Date: 2026-10-18 09:12:41.503617
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd1e1bd71ffbf'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# (index name, table, column)
+INDEXES = [
+    ('ix_actors_movie_id', 'actors', 'movie_id'),
+    ('ix_actors_name', 'actors', 'name'),
+    ('ix_movies_release_date', 'movies', 'release_date'),
+    ('ix_movies_title', 'movies', 'title'),
+]
+
+
+def upgrade():
+    # This is the first revision: databases created before it got their
+    # tables from db.create_all(), so only create what is missing.
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+
+    if 'movies' not in tables:
+        op.create_table(
+            'movies',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('title', sa.String(), nullable=True),
+            sa.Column('release_date', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if 'actors' not in tables:
+        op.create_table(
+            'actors',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(), nullable=True),
+            sa.Column('age', sa.Integer(), nullable=True),
+            sa.Column('gender', sa.String(), nullable=True),
+            sa.Column('movie_id', sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(['movie_id'], ['movies.id'], ),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    for name, table, column in INDEXES:
+        existing = [index['name'] for index in inspector.get_indexes(table)]
+        if name not in existing:
+            op.create_index(name, table, [column], unique=False)
+
+
+def downgrade():
+    for name, table, column in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,46 @@
+"""add collection version sequences
+
+Revision ID: e4a1c7d93f52
+Revises: b58f1e0c6d27
+Create Date: 2026-10-18 20:02:41.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a1c7d93f52'
+down_revision = 'b58f1e0c6d27'
+branch_labels = None
+depends_on = None
+
+
+COLLECTIONS = ('movies', 'actors')
+
+
+def upgrade():
+    bind = op.get_bind()
+    if not bind.dialect.supports_sequences:
+        return
+
+    # Continue from the versions in collection_versions: get_version()
+    # reads start - 1 until the first nextval(), so the ETags issued
+    # before the upgrade stay valid until the next write.
+    versions = dict(bind.execute(sa.text(
+        'SELECT name, version FROM collection_versions')).fetchall())
+    inspector = sa.inspect(bind)
+    existing = inspector.get_sequence_names()
+    for name in COLLECTIONS:
+        sequence = '%s_collection_version' % name
+        if sequence not in existing:
+            op.execute(sa.schema.CreateSequence(
+                sa.Sequence(sequence, start=versions.get(name, 0) + 1)))
+
+
+def downgrade():
+    if not op.get_bind().dialect.supports_sequences:
+        return
+    for name in COLLECTIONS:
+        op.execute(sa.schema.DropSequence(
+            sa.Sequence('%s_collection_version' % name)))
@@ -1,35 +1,415 @@
 import os
+from datetime import datetime
 # from sqlalchemy import ForeignKey, Column, String, Integer, \
 #                     DateTime, create_engine
 # from sqlalchemy.orm import relationship
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 # import json
 # import os
 from flask_migrate import Migrate
+from db_pool import engine_options
+from sqlalchemy.orm import joinedload, lazyload, selectinload, subqueryload
 
 database_name = "fsndcapstone"
 database_path = "postgresql://{}:{}@{}/{}".format('postgres','0613','localhost:5432', database_name)
 
-database_path = os.environ['DATABASE_URL']
-if database_path.startswith("postgres://"):
-  database_path = database_path.replace("postgres://", "postgresql://", 1)
 db = SQLAlchemy()
 
+'''
+Loader options for Movie.actors on ORM queries, by strategy name.
+'selectin' loads the actors of all the movies with one IN-list query,
+'select' is the plain lazy load (one query per movie).
+'''
+ACTORS_LOADERS = {
+    'selectin': selectinload,
+    'subquery': subqueryload,
+    'joined': joinedload,
+    'select': lazyload,
+}
+
+'''
+get_database_path()
+        the DATABASE_URL of the environment, read when the app is set up
+        rather than at import, so importing models needs no database
+'''
+
+
+def get_database_path():
+    database_path = os.environ['DATABASE_URL']
+    if database_path.startswith("postgres://"):
+      database_path = database_path.replace("postgres://", "postgresql://", 1)
+    return database_path
+
+
 '''
 setup_db(app)
         binds a flask application and a SQLAlchemy service
+        does not touch the database: the schema is created explicitly
+        with `flask db upgrade` (or `flask init-db`), unless
+        CREATE_SCHEMA_ON_STARTUP is set
 '''
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None):
+    if database_path is None:
+        database_path = get_database_path()
 
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
-    db.create_all()
     migrate = Migrate(app, db)
 
+    if app.config.get("CREATE_SCHEMA_ON_STARTUP"):
+        with app.app_context():
+            db.create_all()
+            init_collection_versions()
+
+
+'''
+insert_many(model, records)
+        inserts a list of column dicts in a single transaction
+        and returns the new ids in the order of the records
+        uses one multi-row INSERT ... RETURNING where the database
+        supports it, and a flush of the ORM objects otherwise
+'''
+
+
+def insert_many(model, records):
+    try:
+        if db.engine.dialect.full_returning:
+            table = model.__table__
+            result = db.session.execute(
+                table.insert().values(records).returning(table.c.id))
+            ids = [row.id for row in result]
+        else:
+            objects = [model(**record) for record in records]
+            db.session.add_all(objects)
+            db.session.flush()
+            ids = [obj.id for obj in objects]
+        commit_writes(model.invalidates)
+    except BaseException:
+        db.session.rollback()
+        raise
+    return ids
+
+
+'''
+update_returning(model, id, values, versions=None)
+        updates one row and commits, with a single UPDATE ... RETURNING
+        where the database supports it (an UPDATE then a SELECT
+        otherwise); the row's version is incremented, and with versions
+        given only a row at one of those versions is updated
+        with no values the row is only read
+        returns the row, or None if there is no such row
+'''
+
+
+def update_returning(model, id, values, versions=None):
+    table = model.__table__
+    criteria = [table.c.id == id]
+    if versions is not None:
+        criteria.append(table.c.version.in_(versions))
+    if not values:
+        return db.session.execute(table.select().where(*criteria)).first()
+
+    update = (table.update().where(*criteria)
+              .values(version=table.c.version + 1, **values))
+    try:
+        if db.engine.dialect.full_returning:
+            row = db.session.execute(update.returning(*table.c)).first()
+        else:
+            result = db.session.execute(update)
+            row = None
+            if result.rowcount:
+                row = db.session.execute(
+                    table.select().where(table.c.id == id)).first()
+        if row is None:
+            db.session.rollback()
+            return None
+        commit_writes(model.invalidates)
+    except BaseException:
+        db.session.rollback()
+        raise
+    return row
+
+
+'''
+delete_one(model, id, invalidates, versions=None, before=None)
+        deletes one row with a single DELETE and commits, bumping the
+        given collections; with versions given only a row at one of
+        those versions is deleted; before() is run first, in the same
+        transaction, and rolled back with it
+        returns False if there was no such row
+'''
+
+
+def delete_one(model, id, invalidates, versions=None, before=None):
+    table = model.__table__
+    criteria = [table.c.id == id]
+    if versions is not None:
+        criteria.append(table.c.version.in_(versions))
+    try:
+        if before is not None:
+            before()
+        result = db.session.execute(table.delete().where(*criteria))
+        if not result.rowcount:
+            db.session.rollback()
+            return False
+        commit_writes(invalidates)
+    except BaseException:
+        db.session.rollback()
+        raise
+    return True
+
+
+'''
+update_many(model, ids, values)
+        updates the rows with the given ids to the same values with one
+        UPDATE ... WHERE id IN (...) RETURNING id (a SELECT of the ids
+        first where the database has no RETURNING), incrementing their
+        versions, and commits
+        returns the ids of the rows that existed
+'''
+
+
+def update_many(model, ids, values):
+    table = model.__table__
+    update = (table.update().where(table.c.id.in_(ids))
+              .values(version=table.c.version + 1, **values))
+    return _write_many(model, ids, update, model.invalidates)
+
+
+'''
+delete_many(model, ids, invalidates, before=None)
+        deletes the rows with the given ids with one
+        DELETE ... WHERE id IN (...) RETURNING id (see update_many) and
+        commits, bumping the given collections; before() is run first,
+        as in delete_one()
+        returns the ids of the rows that existed
+'''
+
+
+def delete_many(model, ids, invalidates, before=None):
+    table = model.__table__
+    delete = table.delete().where(table.c.id.in_(ids))
+    return _write_many(model, ids, delete, invalidates, before)
+
+
+def _write_many(model, ids, statement, invalidates, before=None):
+    table = model.__table__
+    try:
+        if before is not None:
+            before()
+        if db.engine.dialect.full_returning:
+            result = db.session.execute(statement.returning(table.c.id))
+            found = [row.id for row in result]
+        else:
+            found = [row.id for row in db.session.execute(
+                table.select().with_only_columns([table.c.id])
+                .where(table.c.id.in_(ids)))]
+            if found:
+                db.session.execute(statement)
+        if not found:
+            db.session.rollback()
+            return []
+        commit_writes(invalidates)
+    except BaseException:
+        db.session.rollback()
+        raise
+    return found
+
+
+'''
+get_row_version(model, id)
+        the current version of a row, None if there is no such row
+'''
+
+
+def get_row_version(model, id):
+    table = model.__table__
+    return db.session.execute(
+        table.select().with_only_columns([table.c.version])
+        .where(table.c.id == id)).scalar()
+
+
+#----------------------------------------------------------------------------#
+# Models: CollectionVersion
+#----------------------------------------------------------------------------#
+
+
+'''
+CollectionVersion
+        one row per collection ('movies', 'actors'), bumped in the same
+        transaction as every write to it, so all workers agree on when a
+        list response may have changed; used to answer conditional GETs
+        on databases without sequences (see COLLECTION_SEQUENCES)
+'''
+
+
+class CollectionVersion(db.Model):
+
+    __tablename__ = 'collection_versions'
+
+    name = db.Column(db.String, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+
+COLLECTIONS = ('movies', 'actors')
+
+'''
+COLLECTION_SEQUENCES
+        on Postgres the version of a collection is a sequence instead,
+        advanced with nextval() once a write has committed: nextval()
+        takes no row lock, so concurrent writers to a collection never
+        wait on each other, and a reader that sees the new version
+        always sees the committed write
+'''
+
+COLLECTION_SEQUENCES = {
+    name: db.Sequence('%s_collection_version' % name, metadata=db.metadata)
+    for name in COLLECTIONS
+}
+
+
+def _uses_sequences():
+    return db.engine.dialect.supports_sequences
+
+
+'''
+init_collection_versions()
+        creates the missing CollectionVersion rows, after db.create_all()
+'''
+
+
+def init_collection_versions():
+    if _uses_sequences():
+        return
+    table = CollectionVersion.__table__
+    existing = {row.name for row in db.session.execute(
+        table.select().with_only_columns([table.c.name]))}
+    for name in COLLECTIONS:
+        if name not in existing:
+            db.session.execute(table.insert().values(name=name, version=1))
+    db.session.commit()
+
+
+'''
+bump_versions(names)
+        increments the versions of the given collections in the current
+        transaction with one upsert per collection (an UPDATE then an
+        INSERT of the missing rows where the database has no upsert);
+        not used with COLLECTION_SEQUENCES
+'''
+
+
+def bump_versions(names):
+    table = CollectionVersion.__table__
+    if db.engine.dialect.name == 'sqlite':
+        for name in names:
+            insert = sqlite_insert(table).values(name=name, version=1)
+            db.session.execute(insert.on_conflict_do_update(
+                index_elements=[table.c.name],
+                set_={'version': table.c.version + 1}))
+        return
+
+    result = db.session.execute(
+        table.update()
+        .where(table.c.name.in_(names))
+        .values(version=table.c.version + 1))
+    if result.rowcount < len(names):
+        existing = {row.name for row in db.session.execute(
+            table.select().where(table.c.name.in_(names)))}
+        for name in names:
+            if name not in existing:
+                db.session.execute(table.insert().values(name=name, version=1))
+
+
+def _advance_sequences(names):
+    # one SELECT nextval(...), ... on the session; the write has already
+    # committed, so a failure is logged rather than failing the request,
+    # and these ETags change with the next write instead
+    try:
+        db.session.execute(db.select(
+            [COLLECTION_SEQUENCES[name].next_value() for name in names]))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception(
+            'could not advance the versions of %s', ', '.join(names))
+
+
+'''
+commit_writes(names)
+        commits the write, with the versions of the written collections
+        bumped in the transaction, or their sequences advanced right
+        after it, then tells every function in write_listeners which
+        collections changed (e.g. to drop cached responses)
+'''
+
+write_listeners = []
+
+
+def commit_writes(names):
+    if _uses_sequences():
+        db.session.commit()
+        _advance_sequences(names)
+    else:
+        bump_versions(names)
+        db.session.commit()
+    for listener in write_listeners:
+        listener(names)
+
+
+'''
+get_version(name)
+        the current version of a collection, 0 if it was never written
+'''
+
+
+def get_version(name):
+    if _uses_sequences():
+        sequence = COLLECTION_SEQUENCES[name]
+        # a sequence that nextval() never advanced has is_called false,
+        # and its first nextval() returns last_value itself
+        return db.session.execute(db.text(
+            'SELECT CASE WHEN is_called THEN last_value '
+            'ELSE last_value - 1 END FROM %s' % sequence.name)).scalar()
+
+    table = CollectionVersion.__table__
+    version = db.session.execute(
+        table.select().with_only_columns([table.c.version])
+        .where(table.c.name == name)).scalar()
+    return version or 0
+
+
+'''
+ISODateTime
+        a DateTime column that also takes ISO-8601 strings, as JSON bodies
+        send them, on every database (SQLite only stores datetime
+        objects); other strings are passed on to the database as is
+'''
+
+
+class ISODateTime(db.TypeDecorator):
+    impl = db.DateTime
+    cache_ok = True
+
+    @property
+    def python_type(self):
+        return datetime
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, str):
+            try:
+                return datetime.fromisoformat(value)
+            except ValueError:
+                return value
+        return value
+
 
 #----------------------------------------------------------------------------#
 # Models: Movie
@@ -41,30 +421,151 @@ class Movie(db.Model):
     __tablename__ = 'movies'
 
     id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String)
-    release_date = db.Column(db.DateTime)
+    title = db.Column(db.String, index=True)
+    release_date = db.Column(ISODateTime, index=True)
+    # incremented by every update, for optimistic concurrency control
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        server_default='1')
     actors = db.relationship('Actor', backref="movie", lazy=True)
 
+    __mapper_args__ = {'version_id_col': version}
+
+    # collections whose responses change when a movie is written
+    invalidates = ('movies',)
+
+    # columns read by projected(), in format() order
+    row_columns = ('id', 'title', 'release_date', 'version')
+
+    # relationships list responses can embed with ?include=
+    includes = ('actors',)
+
+    # strategy used by with_actors(), one of ACTORS_LOADERS
+    actors_loading = os.environ.get('MOVIE_ACTORS_LOADING', 'selectin')
+
     def __init__(self, title, release_date):
         self.title = title
         self.release_date = release_date
 
+    @classmethod
+    def projected(cls, columns=None):
+        '''
+        projected(columns)
+            a read-only query of the given columns (row_columns by
+            default) for the list endpoints: the rows are plain tuples,
+            so no Movie objects are built or tracked by the session;
+            format_rows() serializes them
+        '''
+        return db.session.query(
+            *[getattr(cls, name) for name in columns or cls.row_columns])
+
+    @classmethod
+    def with_actors(cls, query=None):
+        '''
+        with_actors(query)
+            returns the query (Movie.query by default) set up to load
+            the actors of all returned movies with actors_loading, so
+            format() does not issue one query per movie; the list
+            endpoints read rows with format_rows() instead
+        '''
+        if query is None:
+            query = cls.query
+        loader = ACTORS_LOADERS[cls.actors_loading]
+        return query.options(loader(cls.actors))
+
+    @classmethod
+    def format_rows(cls, rows, fields=None, include=('actors',)):
+        '''
+        format_rows(rows, fields, include)
+            the format() dicts of projected() rows, restricted to fields
+            (all row_columns by default); with 'actors' included, the
+            actors of all of the rows are read in a single IN-list query
+        '''
+        fields = fields or cls.row_columns
+        items = [{name: getattr(row, name) for name in fields}
+                 for row in rows]
+        if 'actors' in include:
+            actors = {row.id: [] for row in rows}
+            if actors:
+                query = Actor.projected().filter(
+                    Actor.movie_id.in_(list(actors))).order_by(Actor.id)
+                for actor in Actor.format_rows(query):
+                    actors[actor['movie_id']].append(actor)
+            for row, item in zip(rows, items):
+                item['actors'] = actors[row.id]
+        return items
+
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        commit_writes(self.invalidates)
+
+    @classmethod
+    def insert_many(cls, records):
+        return insert_many(cls, records)
+
+    @classmethod
+    def update_by_id(cls, id, values, versions=None):
+        return update_returning(cls, id, values, versions)
+
+    @classmethod
+    def delete_by_id(cls, id, versions=None):
+        '''
+        delete_by_id(id, versions)
+            deletes a movie (at one of versions, if given) with one
+            DELETE statement, see delete_one(); its actors are
+            unassigned first in the same transaction, see
+            unassign_actors()
+        '''
+        table = cls.__table__
+        criterion = table.c.id == id
+        if versions is not None:
+            criterion &= table.c.version.in_(versions)
+        # deleting a movie also unassigns its actors
+        return delete_one(cls, id, cls.invalidates + ('actors',), versions,
+                          before=lambda: cls.unassign_actors(criterion))
+
+    @classmethod
+    def delete_many(cls, ids):
+        '''
+        delete_many(ids)
+            deletes the movies with one DELETE, see delete_by_id()
+            returns the ids of the movies that existed
+        '''
+        criterion = cls.__table__.c.id.in_(ids)
+        return delete_many(cls, ids, cls.invalidates + ('actors',),
+                           before=lambda: cls.unassign_actors(criterion))
+
+    @staticmethod
+    def unassign_actors(criterion):
+        '''
+        unassign_actors(criterion)
+            sets movie_id to null, and increments the version, of the
+            actors of the movies matching criterion, in the current
+            transaction; run before deleting movies, so the
+            ON DELETE SET NULL of actors.movie_id (which SQLite does not
+            enforce) never changes an actor without a new version
+        '''
+        actors = Actor.__table__
+        movies = Movie.__table__
+        db.session.execute(
+            actors.update()
+            .where(actors.c.movie_id.in_(
+                db.select([movies.c.id]).where(criterion)))
+            .values(movie_id=None, version=actors.c.version + 1))
 
     def update(self):
-        db.session.commit()
+        commit_writes(self.invalidates)
 
     def delete(self):
         db.session.delete(self)
-        db.session.commit()
+        # deleting a movie also unassigns its actors
+        commit_writes(self.invalidates + ('actors',))
 
     def format(self):
         return {
             'id': self.id,
             'title': self.title,
             'release_date': self.release_date,
+            'version': self.version,
             'actors': [actor.format() for actor in self.actors]
         }
 
@@ -78,10 +579,26 @@ class Actor(db.Model):
     __tablename__ = 'actors'
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
-    age = db.Column(db.Integer)
-    gender = db.Column(db.String)
-    movie_id = db.Column(db.Integer, db.ForeignKey('movies.id'), nullable=True)
+    name = db.Column(db.String, index=True)
+    age = db.Column(db.Integer, index=True)
+    gender = db.Column(db.String, index=True)
+    movie_id = db.Column(db.Integer,
+                         db.ForeignKey('movies.id', ondelete='SET NULL'),
+                         nullable=True, index=True)
+    # incremented by every update, for optimistic concurrency control
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
+
+    # movies embed their actors, so both lists change with an actor
+    invalidates = ('actors', 'movies')
+
+    # columns read by projected(), in format() order
+    row_columns = ('id', 'name', 'age', 'gender', 'movie_id', 'version')
+
+    # relationships list responses can embed with ?include=
+    includes = ()
 
     def __init__(self, name, age, gender, movie_id):
         self.name = name
@@ -89,16 +606,53 @@ class Actor(db.Model):
         self.gender = gender
         self.movie_id = movie_id
 
+    @classmethod
+    def projected(cls, columns=None):
+        '''
+        projected(columns)
+            a read-only query of the given columns (row_columns by
+            default) as plain rows, see Movie.projected()
+        '''
+        return db.session.query(
+            *[getattr(cls, name) for name in columns or cls.row_columns])
+
+    @classmethod
+    def format_rows(cls, rows, fields=None, include=()):
+        if fields is None:
+            return [row._asdict() for row in rows]
+        return [{name: getattr(row, name) for name in fields}
+                for row in rows]
+
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        commit_writes(self.invalidates)
+
+    @classmethod
+    def insert_many(cls, records):
+        return insert_many(cls, records)
+
+    @classmethod
+    def update_by_id(cls, id, values, versions=None):
+        return update_returning(cls, id, values, versions)
+
+    @classmethod
+    def delete_by_id(cls, id, versions=None):
+        return delete_one(cls, id, cls.invalidates, versions)
+
+    @classmethod
+    def update_many(cls, ids, values):
+        return update_many(cls, ids, values)
+
+    @classmethod
+    def delete_many(cls, ids):
+        return delete_many(cls, ids, cls.invalidates)
 
     def update(self):
-        db.session.commit()
+        commit_writes(self.invalidates)
 
     def delete(self):
         db.session.delete(self)
-        db.session.commit()
+        commit_writes(self.invalidates)
 
     def format(self):
         return {
@@ -106,5 +660,6 @@ class Actor(db.Model):
             'name': self.name,
             'age': self.age,
             'gender': self.gender,
-            "movie_id": self.movie_id
+            "movie_id": self.movie_id,
+            'version': self.version
         }
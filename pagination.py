@@ -0,0 +1,136 @@
+import base64
+import binascii
+import datetime
+import json
+
+from flask import request, abort, current_app
+from sqlalchemy import and_, or_
+
+from filters import indexed_columns, parse_value
+
+
+'''
+encode_cursor(position) / decode_cursor(cursor)
+    the `next` cursor handed to clients is an opaque, url-safe encoding
+    of the key of the last row on the page, e.g. {"id": 42}, plus the
+    sort it belongs to and the row's value of the sort column, e.g.
+    {"id": 42, "sort": "-release_date", "value": "2018-01-13T00:00:00"}
+    decode_cursor also accepts a bare id so `?after=42` keeps working
+'''
+
+
+def encode_cursor(position):
+    data = json.dumps(position, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor):
+    if cursor.isdigit():
+        return {'id': int(cursor)}
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        position = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, ValueError):
+        raise ValueError('invalid cursor')
+    if not isinstance(position, dict) or not isinstance(position.get('id'), int):
+        raise ValueError('invalid cursor')
+    return position
+
+
+'''
+get_page_args(model, sort)
+    reads ?limit= and ?after= from the current request
+    limit defaults to PAGE_SIZE_DEFAULT and is capped at PAGE_SIZE_MAX
+    aborts with 400 on a malformed limit or cursor, or a cursor that
+    was issued for another sort
+'''
+
+
+def get_page_args(model, sort=None):
+    limit = request.args.get('limit', current_app.config['PAGE_SIZE_DEFAULT'])
+    after = request.args.get('after', None)
+
+    try:
+        limit = int(limit)
+        position = decode_cursor(after) if after else None
+        if position is not None:
+            if position.get('sort') != sort:
+                raise ValueError('cursor of another sort')
+            if 'value' in position and position['value'] is not None:
+                column = indexed_columns(model)[sort.lstrip('-')]
+                position['value'] = parse_value(column, position['value'])
+    except (ValueError, TypeError, KeyError):
+        abort(400)
+
+    if limit < 1:
+        abort(400)
+
+    return min(limit, current_app.config['PAGE_SIZE_MAX']), position
+
+
+'''
+seek(query, model, position, sort)
+    orders the query by the sort column (nulls last) then primary key,
+    and skips past the position of a decoded cursor, if any
+'''
+
+
+def seek(query, model, position=None, sort=None):
+    name = (sort or 'id').lstrip('-')
+    descending = bool(sort) and sort.startswith('-')
+
+    if name == 'id':
+        if position is not None:
+            if descending:
+                query = query.filter(model.id < position['id'])
+            else:
+                query = query.filter(model.id > position['id'])
+        return query.order_by(model.id.desc() if descending else model.id)
+
+    column = getattr(model, name)
+    if position is not None:
+        value = position.get('value')
+        if value is None:
+            query = query.filter(column.is_(None), model.id > position['id'])
+        else:
+            query = query.filter(or_(
+                column < value if descending else column > value,
+                and_(column == value, model.id > position['id']),
+                column.is_(None)))
+
+    ordering = column.desc() if descending else column.asc()
+    return query.order_by(ordering.nullslast(), model.id)
+
+
+def _cursor_for(row, sort):
+    position = {'id': row.id}
+    if sort:
+        position['sort'] = sort
+        name = sort.lstrip('-')
+        if name != 'id':
+            value = getattr(row, name)
+            if isinstance(value, datetime.datetime):
+                value = value.isoformat()
+            position['value'] = value
+    return encode_cursor(position)
+
+
+'''
+paginate(query, model, limit, position, sort)
+    keyset pagination on (sort column, primary key): seeks past the last
+    seen row instead of using OFFSET, so every page costs the same
+    however deep the client pages
+    returns the rows of the page and the cursor of the next page
+    (None on the last page)
+'''
+
+
+def paginate(query, model, limit, position=None, sort=None):
+    rows = seek(query, model, position, sort).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _cursor_for(rows[-1], sort)
+
+    return rows, next_cursor
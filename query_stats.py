@@ -0,0 +1,108 @@
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# QueryCounters opened with count_queries()
+_counters = []
+
+
+'''
+QueryCounter
+    statements executed and time spent in the database while a
+    count_queries() block or a request is running
+'''
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.statements.append(statement)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    seconds = time.perf_counter() - conn.info['query_start'].pop()
+
+    for counter in _counters:
+        counter.record(statement, seconds)
+
+    if has_request_context():
+        counter = g.get('query_counter', None)
+        if counter is not None:
+            counter.record(statement, seconds)
+            timings = g.get('phase_timings', None)
+            if timings is not None:
+                timings['sql'] = timings.get('sql', 0.0) + seconds
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    if context.connection is not None:
+        starts = context.connection.info.get('query_start')
+        if starts:
+            starts.pop()
+
+
+'''
+count_queries()
+    counts the statements run on any engine inside the block, e.g.
+        with count_queries() as queries:
+            client.get('/movies')
+        assert queries.count <= 2
+'''
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    _counters.append(counter)
+    try:
+        yield counter
+    finally:
+        _counters.remove(counter)
+
+
+def _start_counter():
+    g.query_counter = QueryCounter()
+
+
+def _check_budget(response):
+    counter = g.get('query_counter', None)
+    budget = current_app.config['SQL_QUERY_BUDGET']
+    if counter is not None and budget and counter.count > budget:
+        current_app.logger.warning(
+            'query budget exceeded: %s %s ran %d statements (budget %d) '
+            'in %.1f ms', request.method, request.path, counter.count,
+            budget, counter.seconds * 1000)
+    return response
+
+
+'''
+init_query_stats(app)
+    counts the statements and database time of every request (the time
+    also shows up as the `sql` phase of the request metrics) and logs
+    the requests that run more than SQL_QUERY_BUDGET statements
+    (0 disables the warning)
+'''
+
+
+def init_query_stats(app):
+    app.before_request(_start_counter)
+    app.after_request(_check_budget)
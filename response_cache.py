@@ -0,0 +1,198 @@
+import hashlib
+import json
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, has_app_context, make_response, request
+
+from lru import ByteLRU
+from models import write_listeners
+from streaming import stream_requested
+
+
+'''
+MemoryBackend
+    the default backend: an in-process LRU bounded by max_bytes
+    each worker has its own, so a write only clears the cache of the
+    worker that handled it; the ttl bounds how stale the others get
+'''
+
+
+class MemoryBackend:
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = ByteLRU(max_bytes)
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self._entries.size
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, value, ttl):
+        self._entries.put(key, value, len(key) + len(value['body']),
+                          time.monotonic() + ttl)
+
+    def generation(self, name):
+        return self._generations.get(name, 0)
+
+    def bump_generation(self, name):
+        with self._lock:
+            self._generations[name] = self._generations.get(name, 0) + 1
+
+
+'''
+RedisBackend
+    a cache shared by all workers (and hosts), so a write clears it
+    for everyone; needs the optional `redis` package
+'''
+
+
+class RedisBackend:
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError(
+                'RESPONSE_CACHE_BACKEND=redis needs the redis package')
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self.client.get('response:' + key)
+        if value is None:
+            return None
+        value = json.loads(value)
+        value['body'] = value['body'].encode('utf-8')
+        return value
+
+    def set(self, key, value, ttl):
+        value = dict(value, body=value['body'].decode('utf-8'))
+        self.client.set('response:' + key, json.dumps(value), ex=ttl)
+
+    def generation(self, name):
+        return int(self.client.get('generation:' + name) or 0)
+
+    def bump_generation(self, name):
+        self.client.incr('generation:' + name)
+
+
+'''
+ResponseCache
+    caches the serialized responses of read endpoints
+    keys are made of the collection's generation, the route, the query
+    string and the caller's permissions; a write to a collection bumps
+    its generation, which makes all of its cached responses unreachable
+'''
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl=30):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, collection, payload):
+        scope = ','.join(sorted(payload.get('permissions', [])))
+        raw = '%s?%s|%s' % (request.path,
+                            request.query_string.decode('latin-1'), scope)
+        return '%s:%s:%s' % (collection, self.backend.generation(collection),
+                             hashlib.sha1(raw.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, response):
+        self.backend.set(key, {
+            'body': response.get_data(),
+            'mimetype': response.mimetype,
+            'etag': response.headers.get('ETag'),
+        }, self.ttl)
+
+    def invalidate(self, names):
+        for name in names:
+            self.backend.bump_generation(name)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+'''
+init_response_cache(app)
+    sets up the cache configured by RESPONSE_CACHE_BACKEND
+    ('memory', 'redis' or 'none') on app.extensions['response_cache']
+'''
+
+
+def init_response_cache(app):
+    backend = app.config['RESPONSE_CACHE_BACKEND']
+    if backend == 'none':
+        return None
+    if backend == 'redis':
+        backend = RedisBackend(app.config['RESPONSE_CACHE_URL'])
+    elif backend == 'memory':
+        backend = MemoryBackend(app.config['RESPONSE_CACHE_MAX_BYTES'])
+    else:
+        raise ValueError('unknown RESPONSE_CACHE_BACKEND %r' % backend)
+
+    cache = ResponseCache(backend, app.config['RESPONSE_CACHE_TTL'])
+    app.extensions['response_cache'] = cache
+    return cache
+
+
+def _invalidate(names):
+    if not has_app_context():
+        return
+    cache = current_app.extensions.get('response_cache')
+    if cache is not None:
+        cache.invalidate(names)
+
+
+write_listeners.append(_invalidate)
+
+
+'''
+@cached_response(collection)
+    serves a GET endpoint from the response cache
+    goes below @requires_auth, so the caller is still authenticated
+    and authorized on every request; only 200 responses are cached and
+    streamed requests always go through to the handler
+'''
+
+
+def cached_response(collection):
+    def cached_response_decorator(f):
+        @wraps(f)
+        def wrapper(payload, *args, **kwargs):
+            cache = current_app.extensions.get('response_cache')
+            if cache is None or stream_requested():
+                return f(payload, *args, **kwargs)
+
+            key = cache.key(collection, payload)
+            value = cache.get(key)
+            if value is not None:
+                etag = value['etag']
+                if etag and request.if_none_match.contains_raw(etag):
+                    response = make_response('', 304)
+                else:
+                    response = make_response(value['body'])
+                    response.mimetype = value['mimetype']
+                if etag:
+                    response.headers['ETag'] = etag
+                return response
+
+            response = f(payload, *args, **kwargs)
+            if response.status_code == 200 and not response.is_streamed:
+                cache.set(key, response)
+            return response
+        return wrapper
+    return cached_response_decorator
@@ -0,0 +1,48 @@
+from flask import Response, current_app, request, stream_with_context
+
+from json_provider import dumps
+
+
+'''
+stream_requested()
+    true if the client asked for a streamed response with ?stream=true
+'''
+
+
+def stream_requested():
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+'''
+stream_collection(key, query, format_rows)
+    streams {"success": true, "<key>": [...], "next": null} to the
+    client while the rows are read from a server-side cursor in batches
+    of STREAM_BATCH_SIZE, so neither the rows, their format() dicts nor
+    the response body are ever held in memory all at once
+    format_rows turns a batch of rows into a list of dicts
+'''
+
+
+def stream_collection(key, query, format_rows):
+    batch_size = current_app.config['STREAM_BATCH_SIZE']
+    rows = query.execution_options(stream_results=True).yield_per(batch_size)
+
+    def encode(batch):
+        return ','.join(dumps(item) for item in format_rows(batch))
+
+    def generate():
+        yield '{"success": true, "%s": [' % key
+        separator = ''
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield separator + encode(batch)
+                separator = ','
+                batch = []
+        if batch:
+            yield separator + encode(batch)
+        yield '], "next": null}'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/json')
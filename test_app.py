@@ -1,10 +1,27 @@
 import os
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+import gzip
+from contextlib import contextmanager
+from unittest import mock
+from datetime import date, datetime
 
 from app import create_app
-from models import setup_db , Movie, Actor
+from models import setup_db , db, get_version, Movie, Actor, \
+    CollectionVersion, COLLECTION_SEQUENCES, init_collection_versions
+from query_stats import count_queries
+from auth.auth import JWT_DECODE_OPTIONS, jwks_store
+from auth.issuer import LocalIssuer, load_roles
+from json_provider import OrjsonBackend, StdlibBackend
+
+
+ISSUER = LocalIssuer.generate(JWT_DECODE_OPTIONS['issuer'],
+                              JWT_DECODE_OPTIONS['audience'])
+jwks_store.load(ISSUER.jwks())
 
 
 class CapstoneTestCase(unittest.TestCase):
@@ -20,28 +37,30 @@ class CapstoneTestCase(unittest.TestCase):
 
         # binds the app to the current context
         with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
             # create all tables
-            self.db.create_all()
-
-        # Set up authentication tokens i
-        with open('auth0_token.json', 'r') as f:
-            self.auth = json.loads(f.read())
+            db.create_all()
 
-        assistant_jwt = self.auth["roles"]["casting_assistant"]["jwt_token"]
-        director_jwt = self.auth["roles"]["casting_director"]["jwt_token"]
-        producer_jwt = self.auth["roles"]["executive_producer"]["jwt_token"]
+        # Tokens signed with a local key and carrying the permissions
+        # of each Auth0 role, so the tests run offline
         self.auth_headers = {
-            "casting_assistant": "Bearer %s" % assistant_jwt,
-            "casting_director": "Bearer %s" % director_jwt,
-            "executive_producer": "Bearer %s" % producer_jwt
+            role: "Bearer %s" % ISSUER.mint_role(role)
+            for role in load_roles()
         }
 
     def tearDown(self):
         """Executed after reach test"""
         pass
 
+    @contextmanager
+    def assertMaxQueries(self, maximum):
+        """Fail if the block runs more than `maximum` SQL statements"""
+        with count_queries() as queries:
+            yield queries
+        self.assertLessEqual(
+            queries.count, maximum,
+            'expected at most %d queries, got %d:\n%s'
+            % (maximum, queries.count, '\n'.join(queries.statements)))
+
     """
     TODO
     Write at least one test for each test for successful operation and for expected errors.
@@ -56,6 +75,30 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['message'], 'welcome')
 
 
+    def test_get_pool_stats_success(self):
+        res = self.client().get('/health/pool')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertIn('checked_out', data['pool'])
+        self.assertIn('wait_max', data['pool'])
+
+    def test_get_movies_server_timing(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        res = self.client().get('/movies?limit=2', headers=header_obj)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('auth;dur=', res.headers['Server-Timing'])
+        self.assertIn('total;dur=', res.headers['Server-Timing'])
+
+        res = self.client().get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('http_request_phase_seconds_count{route="GET /movies",phase="total"}',
+                      res.data.decode())
+
     def test_get_movies_success(self):
         header_obj = {
             "Authorization": self.auth_headers["casting_assistant"]
@@ -67,6 +110,376 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(type(data['movies']) == list)
 
+    def test_get_movies_paginated(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        res = self.client().get('/movies?limit=1', headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(len(data['movies']) <= 1)
+        self.assertIn('next', data)
+
+        if data['next']:
+            res = self.client().get('/movies?limit=1&after=%s' % data['next'],
+                                    headers=header_obj)
+            next_page = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertTrue(next_page['movies'][0]['id'] > data['movies'][0]['id'])
+
+    def test_get_movies_invalid_limit_400(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        res = self.client().get('/movies?limit=abc', headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_projected_rows_match_format(self):
+        with self.app.app_context():
+            # with_actors() reads the actors of every movie in one query
+            with self.assertMaxQueries(2):
+                movies = (Movie.with_actors().order_by(Movie.id)
+                          .limit(20).all())
+                expected = [movie.format() for movie in movies]
+            for movie in expected:
+                movie['actors'].sort(key=lambda actor: actor['id'])
+
+            rows = Movie.projected().order_by(Movie.id).limit(20).all()
+            self.assertEqual(Movie.format_rows(rows), expected)
+
+            actors = Actor.query.order_by(Actor.id).limit(20).all()
+            rows = Actor.projected().order_by(Actor.id).limit(20).all()
+            self.assertEqual(Actor.format_rows(rows),
+                             [actor.format() for actor in actors])
+
+    def test_get_movies_release_date_is_iso_8601(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        res = self.client().get('/movies', headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        for movie in data['movies']:
+            if movie['release_date'] is not None:
+                datetime.fromisoformat(movie['release_date'])
+
+    def test_get_movies_query_budget(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        # one query for the page of movies, one for all of their actors,
+        # plus the collection version lookup
+        with self.assertMaxQueries(3):
+            res = self.client().get('/movies?limit=50&sort=id',
+                                    headers=header_obj)
+        self.assertEqual(res.status_code, 200)
+
+    def test_get_actors_query_budget(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        with self.assertMaxQueries(2):
+            res = self.client().get('/actors?limit=50&sort=id',
+                                    headers=header_obj)
+        self.assertEqual(res.status_code, 200)
+
+    def test_update_movie_query_budget(self):
+        header_obj = {
+            "Authorization": self.auth_headers["executive_producer"]
+        }
+        # the UPDATE ... RETURNING of the write's transaction, the
+        # SELECT nextval() that advances the movies version once it has
+        # committed, and the actors of the updated movie for the response
+        with self.assertMaxQueries(3):
+            res = self.client().patch('/movies/1',
+                                      json = {"title": "test_patch"},
+                                      headers=header_obj)
+        self.assertEqual(res.status_code, 200)
+
+    def test_get_movies_streamed(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        res = self.client().get('/movies?stream=true', headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(type(data['movies']) == list)
+        self.assertIsNone(data['next'])
+
+    def test_export_movies_ndjson(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        with self.assertMaxQueries(1):
+            res = self.client().get('/export/movies', headers=header_obj)
+            lines = res.data.decode('utf-8').splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(lines), Movie.query.count())
+        for line in lines:
+            self.assertEqual(set(json.loads(line)),
+                             {'id', 'title', 'release_date', 'version'})
+
+    def test_export_cast_csv_gzip(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"],
+            "Accept-Encoding": "gzip"
+        }
+        res = self.client().get('/export/cast?format=csv', headers=header_obj)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+
+        lines = gzip.decompress(res.data).decode('utf-8').splitlines()
+        self.assertEqual(lines[0], 'actor_id,name,age,gender,movie_id,'
+                                   'movie_title,movie_release_date')
+        self.assertEqual(len(lines) - 1, Actor.query.count())
+
+    def test_export_cast_needs_view_movies_403(self):
+        header_obj = {
+            "Authorization": "Bearer %s" % ISSUER.mint(['view:actors'])
+        }
+        res = self.client().get('/export/cast', headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 403)
+        self.assertFalse(data['success'])
+
+    def test_export_unknown_format_400(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        res = self.client().get('/export/actors?format=xml', headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_import_movies_ndjson(self):
+        header_obj = {
+            "Authorization": self.auth_headers["executive_producer"],
+            "Content-Type": "application/x-ndjson"
+        }
+        title = "import test %f" % time.time()
+        body = "\n".join(json.dumps(record) for record in [
+            {"title": title, "release_date": "2018-01-13"},
+            {"title": title, "release_date": "2018-01-13"},
+            {"title": title, "release_date": "13/01/2018"}
+        ])
+        res = self.client().post('/import/movies', data=body,
+                                 headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual((data['read'], data['inserted'], data['skipped'],
+                          data['errors']), (3, 2, 0, 1))
+        self.assertEqual(data['rejected'], [
+            {"line": 3, "errors": {"release_date": "not a valid datetime"}}
+        ])
+
+        # with dedupe, the rows already imported are skipped
+        res = self.client().post('/import/movies?dedupe=true', data=body,
+                                 headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual((data['inserted'], data['skipped']), (0, 2))
+
+    def test_import_actors_csv_unknown_movie(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_director"],
+            "Content-Type": "text/csv"
+        }
+        res = self.client().post('/import/actors',
+                                 data="name,age,gender,movie_id\n"
+                                      "Clara Becker,21,F,100000\n",
+                                 headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 0)
+        self.assertEqual(data['rejected'], [
+            {"line": 2, "errors": {"movie_id": "does not exist"}}
+        ])
+
+    def test_import_actors_forbidden_403(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        res = self.client().post('/import/actors', data='', headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 403)
+        self.assertFalse(data['success'])
+
+    def test_import_command_writes_error_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'movies.csv')
+            errors_path = os.path.join(directory, 'errors.ndjson')
+            with open(path, 'w') as f:
+                f.write('title,release_date\n'
+                        'import test %f,2018-01-13\n'
+                        ',2018-01-13\n' % time.time())
+
+            result = self.app.test_cli_runner().invoke(
+                args=['import', 'movies', path, '--errors', errors_path])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('inserted 1, skipped 0, rejected 1', result.output)
+            with open(errors_path) as f:
+                errors = [json.loads(line) for line in f]
+        self.assertEqual(errors, [{
+            "line": 3,
+            "errors": {"title": "missing"},
+            "record": {"title": "", "release_date": "2018-01-13"}
+        }])
+
+    def test_get_actors_filtered_and_sorted(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        res = self.client().get('/actors?gender=F&age[gte]=20&sort=-age',
+                                headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(all(actor['gender'] == 'F' for actor in data['actors']))
+        self.assertTrue(all(actor['age'] >= 20 for actor in data['actors']))
+        ages = [actor['age'] for actor in data['actors']]
+        self.assertEqual(ages, sorted(ages, reverse=True))
+
+    def test_get_actors_unknown_filter_400(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        res = self.client().get('/actors?nickname=Clara', headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_get_movies_sparse_fieldset(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        res = self.client().get('/movies?fields=title', headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        for movie in data['movies']:
+            self.assertEqual(set(movie), {'id', 'title'})
+
+    def test_get_movies_sparse_fieldset_include_actors(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        res = self.client().get('/movies?fields=title&include=actors',
+                                headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        for movie in data['movies']:
+            self.assertEqual(set(movie), {'id', 'title', 'actors'})
+
+    def test_get_actors_unknown_field_400(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        res = self.client().get('/actors?fields=name,nickname',
+                                headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_get_movies_not_modified_304(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        res = self.client().get('/movies', headers=header_obj)
+        etag = res.headers['ETag']
+
+        header_obj['If-None-Match'] = etag
+        res = self.client().get('/movies', headers=header_obj)
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+
+    def test_get_movies_etag_changes_after_write(self):
+        header_obj = {
+            "Authorization": self.auth_headers["executive_producer"]
+        }
+        res = self.client().get('/movies', headers=header_obj)
+        etag = res.headers['ETag']
+
+        self.client().post('/movies',
+                           json = {
+                            "title": "test",
+                            "release_date": "2018-01-13"
+                              } , headers=header_obj)
+
+        header_obj['If-None-Match'] = etag
+        res = self.client().get('/movies', headers=header_obj)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_etag_changes_after_first_write_on_fresh_database(self):
+        with self.app.app_context():
+            for sequence in COLLECTION_SEQUENCES.values():
+                sequence.drop(db.engine, checkfirst=True)
+                sequence.create(db.engine)
+            db.session.execute(CollectionVersion.__table__.delete())
+            db.session.commit()
+            init_collection_versions()
+
+        header_obj = {
+            "Authorization": self.auth_headers["executive_producer"]
+        }
+        res = self.client().get('/movies', headers=header_obj)
+        etag = res.headers['ETag']
+
+        self.client().post('/movies',
+                           json = {
+                            "title": "test",
+                            "release_date": "2018-01-13"
+                              } , headers=header_obj)
+
+        header_obj['If-None-Match'] = etag
+        res = self.client().get('/movies', headers=header_obj)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_collection_versions_advance_on_write(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_director"]
+        }
+        with self.app.app_context():
+            before = (get_version('movies'), get_version('actors'))
+
+        self.client().patch('/actors/1', json = {"age": 30},
+                            headers=header_obj)
+
+        with self.app.app_context():
+            after = (get_version('movies'), get_version('actors'))
+        self.assertGreater(after[0], before[0])
+        self.assertGreater(after[1], before[1])
+
+    def test_get_movies_cache_invalidated_by_update(self):
+        header_obj = {
+            "Authorization": self.auth_headers["executive_producer"]
+        }
+        self.client().get('/movies?id=1', headers=header_obj)
+        self.client().patch('/movies/1',
+                            json = {"title": "test_cache"},
+                            headers=header_obj)
+
+        res = self.client().get('/movies?id=1', headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['movies'][0]['title'], 'test_cache')
+
     def test_get_movie_unauthorized_401(self):
         res = self.client().get('/movies')
         data = json.loads(res.data)
@@ -150,7 +563,7 @@ class CapstoneTestCase(unittest.TestCase):
         }
         res = self.client().delete('/actors/10000', headers=header_obj)
         data = json.loads(res.data)
-        self.assertEqual(res.status_code, 422)
+        self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
 
 
@@ -179,6 +592,49 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 422)
         self.assertTrue(data['success'] == False)
 
+    def test_create_movies_batch_success(self):
+        header_obj = {
+            "Authorization": self.auth_headers["executive_producer"]
+        }
+        res = self.client().post('/movies/batch',
+                                 json = [
+                                     {"title": "test", "release_date": "2018-01-13"},
+                                     {"title": "test2", "release_date": "2019-01-13"}
+                                    ], headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(len(data['ids']), 2)
+        self.assertTrue(data['ids'][0] < data['ids'][1])
+
+    def test_create_movies_batch_missing_field(self):
+        header_obj = {
+            "Authorization": self.auth_headers["executive_producer"]
+        }
+        res = self.client().post('/movies/batch',
+                                 json = [
+                                     {"title": "test", "release_date": "2018-01-13"},
+                                     {"title": "test2"}
+                                    ], headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(data['success'])
+
+    def test_create_actors_batch_forbidden_403(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        res = self.client().post('/actors/batch',
+                                 json = [{
+                                      "name": "Gustavo Wolfe",
+                                      "age": "25",
+                                      "gender": "F",
+                                      "movie_id": "1"
+                                    }], headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 403)
+        self.assertFalse(data['success'])
+
     def test_delete_movies_success(self):
         header_obj = {
             "Authorization": self.auth_headers["executive_producer"]
@@ -199,13 +655,172 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data['success'])
 
+    def test_delete_movie_unassigns_actors(self):
+        header_obj = {
+            "Authorization": self.auth_headers["executive_producer"]
+        }
+        res = self.client().post('/movies',
+                                 json = {
+                                  "title": "test",
+                                  "release_date": "2018-01-13"
+                                    } , headers=header_obj)
+        movie_id = json.loads(res.data)['id']
+        res = self.client().post('/actors',
+                                 json = {
+                                     "name": "Clara Becker",
+                                     "age": 21,
+                                     "gender": "F",
+                                     "movie_id": movie_id
+                                    } , headers=header_obj)
+        actor_id = json.loads(res.data)['id']
+
+        res = self.client().delete('/movies/%s' % movie_id, headers=header_obj)
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().get('/actors?id=%s' % actor_id, headers=header_obj)
+        data = json.loads(res.data)
+        self.assertIsNone(data['actors'][0]['movie_id'])
+        # the unassignment is a new version of the actor
+        self.assertEqual(data['actors'][0]['version'], 2)
+
+    def test_delete_movie_stale_keeps_actors(self):
+        header_obj = {
+            "Authorization": self.auth_headers["executive_producer"]
+        }
+        res = self.client().post('/movies',
+                                 json = {
+                                  "title": "test",
+                                  "release_date": "2018-01-13"
+                                    } , headers=header_obj)
+        movie_id = json.loads(res.data)['id']
+        res = self.client().post('/actors',
+                                 json = {
+                                     "name": "Clara Becker",
+                                     "age": 21,
+                                     "gender": "F",
+                                     "movie_id": movie_id
+                                    } , headers=header_obj)
+        actor_id = json.loads(res.data)['id']
+
+        res = self.client().delete('/movies/%s' % movie_id,
+                                   headers=dict(header_obj,
+                                                **{'If-Match': '"99"'}))
+        self.assertEqual(res.status_code, 412)
+
+        # the unassignment is rolled back with the DELETE
+        res = self.client().get('/actors?id=%s' % actor_id, headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(data['actors'][0]['movie_id'], movie_id)
+        self.assertEqual(data['actors'][0]['version'], 1)
+
+    def test_assign_actors_batch_success(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_director"]
+        }
+        res = self.client().post('/actors/batch',
+                                 json = [
+                                     {"name": "Clara Becker", "age": 21, "gender": "F", "movie_id": 1},
+                                     {"name": "Itzel Ramon", "age": 29, "gender": "F", "movie_id": 1}
+                                    ], headers=header_obj)
+        ids = json.loads(res.data)['ids']
+
+        res = self.client().patch('/actors/batch',
+                                  json = {"ids": ids + [100000], "movie_id": None},
+                                  headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['results'], [
+            {"id": ids[0], "status": 200},
+            {"id": ids[1], "status": 200},
+            {"id": 100000, "status": 404}
+        ])
+
+        res = self.client().get('/actors?id=%s' % ids[0], headers=header_obj)
+        data = json.loads(res.data)
+        self.assertIsNone(data['actors'][0]['movie_id'])
+        self.assertEqual(data['actors'][0]['version'], 2)
+
+    def test_assign_actors_batch_missing_movie_id(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_director"]
+        }
+        res = self.client().patch('/actors/batch', json = {"ids": [1]},
+                                  headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(data['success'])
+
+    def test_assign_actors_batch_unknown_movie_id(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_director"]
+        }
+        res = self.client().patch('/actors/batch',
+                                  json = {"ids": [1], "movie_id": 100000},
+                                  headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
+    def test_assign_actors_batch_malformed_movie_id(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_director"]
+        }
+        res = self.client().patch('/actors/batch',
+                                  json = {"ids": [1], "movie_id": "one"},
+                                  headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(data['success'])
+
+    def test_delete_actors_batch_forbidden_403(self):
+        header_obj = {
+            "Authorization": self.auth_headers["casting_assistant"]
+        }
+        res = self.client().delete('/actors/batch', json = {"ids": [1]},
+                                   headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 403)
+        self.assertFalse(data['success'])
+
+    def test_delete_movies_batch_success(self):
+        header_obj = {
+            "Authorization": self.auth_headers["executive_producer"]
+        }
+        res = self.client().post('/movies',
+                                 json = {
+                                  "title": "test",
+                                  "release_date": "2018-01-13"
+                                    } , headers=header_obj)
+        movie_id = json.loads(res.data)['id']
+
+        res = self.client().delete('/movies/batch',
+                                   json = {"ids": [movie_id, 100000]},
+                                   headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['results'], [
+            {"id": movie_id, "status": 200},
+            {"id": 100000, "status": 404}
+        ])
+
+    def test_delete_movies_batch_empty_ids(self):
+        header_obj = {
+            "Authorization": self.auth_headers["executive_producer"]
+        }
+        res = self.client().delete('/movies/batch', json = {"ids": []},
+                                   headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(data['success'])
+
     def test_delete_movies_failed(self):
         header_obj = {
             "Authorization": self.auth_headers["executive_producer"]
         }
         res = self.client().delete('/movies/10000', headers=header_obj)
         data = json.loads(res.data)
-        self.assertEqual(res.status_code, 422)
+        self.assertEqual(res.status_code, 404)
         self.assertTrue(data['success'] == False)
 
     def test_update_movies_success(self):
@@ -231,7 +846,7 @@ class CapstoneTestCase(unittest.TestCase):
                                   "release_date": "2020-02-13"
                                     } , headers=header_obj)
         data = json.loads(res.data)
-        self.assertEqual(res.status_code, 422)
+        self.assertEqual(res.status_code, 404)
         self.assertFalse(data['success'])
 
     def test_update_actor_success(self):
@@ -247,6 +862,74 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data['success'])
 
+    def test_update_actor_returns_new_version(self):
+        header_obj = {
+            "Authorization": self.auth_headers["executive_producer"]
+        }
+        res = self.client().patch('/actors/1', json = {"age": 30},
+                                  headers=header_obj)
+        data = json.loads(res.data)
+        version = data['version']
+        self.assertEqual(res.headers['ETag'], '"%d"' % version)
+
+        header_obj['If-Match'] = res.headers['ETag']
+        res = self.client().patch('/actors/1', json = {"age": 31},
+                                  headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['version'], version + 1)
+
+    def test_update_actor_stale_if_match_412(self):
+        header_obj = {
+            "Authorization": self.auth_headers["executive_producer"]
+        }
+        res = self.client().patch('/actors/1', json = {"age": 30},
+                                  headers=header_obj)
+        stale = res.headers['ETag']
+        self.client().patch('/actors/1', json = {"age": 31},
+                            headers=header_obj)
+
+        header_obj['If-Match'] = stale
+        res = self.client().patch('/actors/1', json = {"age": 32},
+                                  headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 412)
+        self.assertFalse(data['success'])
+
+    def test_update_movie_stale_version_409(self):
+        header_obj = {
+            "Authorization": self.auth_headers["executive_producer"]
+        }
+        res = self.client().patch('/movies/1', json = {"title": "test_patch"},
+                                  headers=header_obj)
+        version = json.loads(res.data)['updated']['version']
+
+        res = self.client().patch('/movies/1',
+                                  json = {"title": "stale", "version": version - 1},
+                                  headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 409)
+        self.assertFalse(data['success'])
+
+    def test_delete_actor_stale_if_match_412(self):
+        header_obj = {
+            "Authorization": self.auth_headers["executive_producer"]
+        }
+        res = self.client().post('/actors',
+                                 json = {
+                                     "name": "Clara Becker",
+                                     "age": 21,
+                                     "gender": "F",
+                                     "movie_id": 1
+                                    } , headers=header_obj)
+        actor_id = json.loads(res.data)['id']
+        self.client().patch('/actors/%s' % actor_id, json = {"age": 22},
+                            headers=header_obj)
+
+        header_obj['If-Match'] = '"1"'
+        res = self.client().delete('/actors/%s' % actor_id, headers=header_obj)
+        self.assertEqual(res.status_code, 412)
+
     def test_update_actor_failed_unexpected_id(self):
         header_obj = {
             "Authorization": self.auth_headers["executive_producer"]
@@ -257,11 +940,132 @@ class CapstoneTestCase(unittest.TestCase):
                                      "age": "21"
                                     } , headers=header_obj)
         data = json.loads(res.data)
-        self.assertEqual(res.status_code, 422)
+        self.assertEqual(res.status_code, 404)
         self.assertFalse(data['success'])
 
 
 
+class StartupTestCase(unittest.TestCase):
+    """This class represents the startup test case"""
+
+    def test_import_without_database_io_within_budget(self):
+        # an unreachable database: importing must not try to connect
+        env = dict(os.environ,
+                   DATABASE_URL='postgresql://nobody@127.0.0.1:1/unreachable')
+        code = ('import time; start = time.perf_counter(); '
+                'import app, models; print(time.perf_counter() - start)')
+        result = subprocess.run(
+            [sys.executable, '-c', code], env=env,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        self.assertEqual(result.returncode, 0, result.stderr.decode())
+        budget = float(os.environ.get('IMPORT_TIME_BUDGET', 2.0))
+        self.assertLess(float(result.stdout), budget)
+
+    def test_create_app_does_not_read_roles(self):
+        # auth0_token.json is only needed by `flask issue-token`
+        with mock.patch('app.load_roles') as load_roles:
+            create_app()
+        load_roles.assert_not_called()
+
+
+class PoolTestCase(unittest.TestCase):
+    """This class represents the connection pool statistics test case"""
+
+    def test_only_exhausted_checkouts_count_as_timeouts(self):
+        import sqlite3
+        from sqlalchemy import exc
+        from db_pool import TimedQueuePool
+
+        pool = TimedQueuePool(lambda: sqlite3.connect(':memory:'),
+                              pool_size=1, max_overflow=0, timeout=0.01)
+        connection = pool.connect()
+        with self.assertRaises(exc.TimeoutError):
+            pool.connect()
+        connection.close()
+        self.assertEqual(pool.timeouts, 1)
+
+        def refuse():
+            raise sqlite3.OperationalError('connection refused')
+
+        pool = TimedQueuePool(refuse, pool_size=1, max_overflow=0)
+        with self.assertRaises(sqlite3.OperationalError):
+            pool.connect()
+        self.assertEqual(pool.timeouts, 0)
+        self.assertEqual(pool.checkouts, 1)
+
+
+class JSONProviderTestCase(unittest.TestCase):
+    """This class represents the JSON encoding test case"""
+
+    def setUp(self):
+        self.data = {
+            'success': True,
+            'movies': [{'id': 1, 'title': 'Ünïcode "quoted"',
+                        'release_date': datetime(2018, 1, 13),
+                        'premiere': date(2018, 1, 1),
+                        'actors': []}],
+            'next': None,
+        }
+
+    def test_stdlib_writes_iso_8601_dates(self):
+        encoded = json.loads(StdlibBackend().dumps(self.data))
+
+        self.assertEqual(encoded['movies'][0]['release_date'],
+                         '2018-01-13T00:00:00')
+        self.assertEqual(encoded['movies'][0]['premiere'], '2018-01-01')
+
+    def test_backends_agree(self):
+        try:
+            orjson = OrjsonBackend()
+        except ImportError:
+            self.skipTest('orjson is not installed')
+
+        self.assertEqual(orjson.dumps(self.data),
+                         StdlibBackend().dumps(self.data))
+
+    def test_unknown_backend_is_rejected(self):
+        with self.assertRaises(ValueError):
+            create_app({'JSON_BACKEND': 'yaml'})
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    """This class represents the benchmark harness test case"""
+
+    def test_scenarios_cover_every_route(self):
+        import random
+        from benchmark import scenarios
+
+        app = create_app()
+        adapter = app.url_map.bind('localhost')
+        covered = set()
+        for scenario in scenarios([1, 2, 3], [1, 2, 3]):
+            path, body = scenario.build(0, random.Random(0))
+            endpoint, args = adapter.match(path.split('?')[0],
+                                           method=scenario.method)
+            covered.add(endpoint)
+
+        routes = {rule.endpoint for rule in app.url_map.iter_rules()
+                  if rule.endpoint != 'static'}
+        self.assertEqual(routes - covered, set())
+
+    def test_benchmark_reports_every_route_offline(self):
+        env = dict(os.environ, DATABASE_URL='sqlite://')
+        result = subprocess.run(
+            [sys.executable, 'benchmark.py', '--movies', '20',
+             '--actors', '40', '--requests', '5', '--concurrency', '2'],
+            env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        self.assertEqual(result.returncode, 0, result.stderr.decode())
+        report = json.loads(result.stdout)
+        routes = {route['route']: route for route in report['routes']}
+        for name, route in routes.items():
+            self.assertEqual(route['errors'], 0, name)
+            self.assertIsNotNone(route['p99_ms'], name)
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -134,7 +134,7 @@ class CapstoneTestCase(unittest.TestCase):
         }
         res = requests.delete(self.heroku_url + '/actors/10000', headers=header_obj)
         data = res.json()
-        self.assertEqual(res.status_code, 422)
+        self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
 
 
@@ -189,7 +189,7 @@ class CapstoneTestCase(unittest.TestCase):
         }
         res = requests.delete(self.heroku_url + '/movies/10000', headers=header_obj)
         data = res.json()
-        self.assertEqual(res.status_code, 422)
+        self.assertEqual(res.status_code, 404)
         self.assertTrue(data['success'] == False)
 
     def test_update_movies_success(self):
@@ -215,7 +215,7 @@ class CapstoneTestCase(unittest.TestCase):
                                   "release_date": "2020-02-13"
                                     } , headers=header_obj)
         data = res.json()
-        self.assertEqual(res.status_code, 422)
+        self.assertEqual(res.status_code, 404)
         self.assertFalse(data['success'])
 
     def test_update_actor_success(self):
@@ -241,7 +241,7 @@ class CapstoneTestCase(unittest.TestCase):
                                      "age": "21"
                                     } , headers=header_obj)
         data = res.json()
-        self.assertEqual(res.status_code, 422)
+        self.assertEqual(res.status_code, 404)
         self.assertFalse(data['success'])
 
 
@@ -0,0 +1,259 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from Crypto.PublicKey import RSA
+from jose import jwt
+
+from auth import auth, jwks
+from auth.issuer import LocalIssuer, load_roles, long_to_base64
+from auth.jwks import JWKSKeyStore, parse_max_age
+from auth.token_cache import VerifiedTokenCache
+
+
+PRIVATE_KEY = RSA.generate(1024)
+
+
+def public_jwk(kid):
+    public_key = PRIVATE_KEY.publickey()
+    return {'kid': kid, 'kty': 'RSA', 'use': 'sig',
+            'n': long_to_base64(public_key.n),
+            'e': long_to_base64(public_key.e)}
+
+
+class FakeResponse:
+    def __init__(self, keys, cache_control=None):
+        self.body = json.dumps({'keys': keys}).encode()
+        self.headers = {}
+        if cache_control is not None:
+            self.headers['Cache-Control'] = cache_control
+
+    def read(self):
+        return self.body
+
+
+class JWKSKeyStoreTestCase(unittest.TestCase):
+    """This class represents the JWKS cache test case"""
+
+    def setUp(self):
+        self.keys = [public_jwk('key-1')]
+        self.cache_control = 'public, max-age=15000'
+        self.fetches = 0
+
+        def fake_urlopen(url, timeout=None):
+            self.fetches += 1
+            return FakeResponse(self.keys, self.cache_control)
+
+        patcher = mock.patch.object(jwks, 'urlopen', fake_urlopen)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.store = JWKSKeyStore('https://example.test/.well-known/jwks.json')
+
+    def test_parse_max_age(self):
+        self.assertEqual(parse_max_age('public, max-age=15000'), 15000)
+        self.assertIsNone(parse_max_age('no-cache'))
+        self.assertIsNone(parse_max_age(None))
+
+    def test_keys_are_cached(self):
+        for _ in range(5):
+            self.assertIsNotNone(self.store.get_key('key-1'))
+
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(self.store.stats()['hits'], 4)
+        self.assertEqual(self.store.stats()['misses'], 1)
+
+    def test_expired_cache_is_refetched(self):
+        self.cache_control = 'max-age=0'
+        self.store.get_key('key-1')
+        self.store.get_key('key-1')
+
+        self.assertEqual(self.fetches, 2)
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        self.store.get_key('key-1')
+        self.keys.append(public_jwk('key-2'))
+
+        # the first fetch just happened, so the rotated key is not picked up
+        self.assertIsNone(self.store.get_key('key-2'))
+        self.assertEqual(self.fetches, 1)
+
+        self.store.min_refresh_interval = 0
+        self.assertIsNotNone(self.store.get_key('key-2'))
+        self.assertEqual(self.fetches, 2)
+
+    def test_concurrent_expired_lookups_fetch_once(self):
+        self.store.get_key('key-1')
+        self.store._expires_at = 0
+
+        def slow_urlopen(url, timeout=None):
+            self.fetches += 1
+            time.sleep(0.05)
+            return FakeResponse(self.keys, self.cache_control)
+
+        with mock.patch.object(jwks, 'urlopen', slow_urlopen):
+            threads = [threading.Thread(target=self.store.get_key,
+                                        args=('key-1',)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(self.fetches, 2)
+
+    def test_stale_keys_served_when_fetch_fails(self):
+        self.cache_control = 'max-age=0'
+        self.store.get_key('key-1')
+
+        with mock.patch.object(jwks, 'urlopen', side_effect=OSError):
+            self.assertIsNotNone(self.store.get_key('key-1'))
+
+    def test_keys_are_prebuilt_objects(self):
+        self.keys.append({'kid': 'enc-key', 'kty': 'RSA', 'use': 'enc'})
+        key = self.store.get_key('key-1')
+
+        self.assertEqual(key.n, PRIVATE_KEY.n)
+        self.assertNotIn('enc-key', self.store._keys)
+
+
+class VerifyDecodeJwtTestCase(unittest.TestCase):
+    """This class represents the JWT verification test case"""
+
+    def setUp(self):
+        store = JWKSKeyStore('https://example.test/.well-known/jwks.json')
+        store._keys = store.index({'keys': [public_jwk('key-1')]})
+        store._expires_at = float('inf')
+
+        patcher = mock.patch.object(auth, 'jwks_store', store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.claims = {
+            'iss': auth.JWT_DECODE_OPTIONS['issuer'],
+            'aud': auth.API_AUDIENCE,
+            'exp': int(time.time()) + 3600,
+            'permissions': ['view:movies'],
+        }
+
+    def encode(self, claims, kid='key-1'):
+        return jwt.encode(claims, PRIVATE_KEY.exportKey('PEM').decode(),
+                          algorithm='RS256', headers={'kid': kid})
+
+    def test_valid_token_is_decoded(self):
+        payload = auth.verify_decode_jwt(self.encode(self.claims))
+
+        self.assertEqual(payload['permissions'], ['view:movies'])
+
+    def test_wrong_audience_is_rejected(self):
+        self.claims['aud'] = 'someone-else'
+
+        with self.assertRaises(auth.AuthError) as context:
+            auth.verify_decode_jwt(self.encode(self.claims))
+        self.assertEqual(context.exception.error['code'], 'invalid_claims')
+
+    def test_unknown_kid_is_rejected(self):
+        with mock.patch.object(auth.jwks_store, 'get_key', return_value=None):
+            with self.assertRaises(auth.AuthError) as context:
+                auth.verify_decode_jwt(self.encode(self.claims, kid='key-9'))
+        self.assertEqual(context.exception.status_code, 400)
+
+
+class LocalIssuerTestCase(unittest.TestCase):
+    """This class represents the local token issuer test case"""
+
+    def setUp(self):
+        self.issuer = LocalIssuer(PRIVATE_KEY, auth.JWT_DECODE_OPTIONS['issuer'],
+                                  auth.API_AUDIENCE)
+        self.store = JWKSKeyStore('https://example.test/.well-known/jwks.json')
+
+        patcher = mock.patch.object(auth, 'jwks_store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_role_token_carries_role_permissions(self):
+        self.store.load(self.issuer.jwks())
+
+        for role, permissions in load_roles().items():
+            payload = auth.verify_decode_jwt(self.issuer.mint_role(role))
+            self.assertEqual(payload['permissions'], permissions)
+            self.assertEqual(payload['sub'], 'local|%s' % role)
+
+    def test_loaded_keys_are_never_fetched(self):
+        self.store.load(self.issuer.jwks())
+
+        with mock.patch.object(jwks, 'urlopen') as urlopen:
+            self.assertIsNone(self.store.get_key('other'))
+            self.assertIsNotNone(self.store.get_key('local'))
+        urlopen.assert_not_called()
+
+    def test_file_based_jwks(self):
+        directory = tempfile.mkdtemp()
+        self.store.url = self.issuer.write_jwks(
+            os.path.join(directory, 'jwks.json'))
+
+        payload = auth.verify_decode_jwt(self.issuer.mint(['view:actors']))
+        self.assertEqual(payload['permissions'], ['view:actors'])
+        self.assertEqual(self.store.stats()['refreshes'], 1)
+
+    def test_expired_token_is_rejected(self):
+        self.store.load(self.issuer.jwks())
+
+        with self.assertRaises(auth.AuthError) as context:
+            auth.verify_decode_jwt(self.issuer.mint([], expires_in=-60))
+        self.assertEqual(context.exception.error['code'], 'token_expired')
+
+    def test_unknown_role_is_rejected(self):
+        with self.assertRaises(KeyError):
+            self.issuer.mint_role('stunt_double')
+
+
+class VerifiedTokenCacheTestCase(unittest.TestCase):
+    """This class represents the verified token cache test case"""
+
+    def setUp(self):
+        self.cache = VerifiedTokenCache(max_bytes=4096, max_ttl=300)
+        self.payload = {'sub': 'auth0|1', 'exp': time.time() + 3600,
+                        'permissions': ['view:movies']}
+
+    def test_cached_payload_is_returned(self):
+        self.assertIsNone(self.cache.get('token-a'))
+        self.cache.put('token-a', self.payload)
+
+        self.assertEqual(self.cache.get('token-a'), self.payload)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_raw_token_is_not_stored(self):
+        self.cache.put('token-a', self.payload)
+
+        self.assertNotIn('token-a', self.cache._entries)
+
+    def test_entry_expires_at_exp_claim(self):
+        self.payload['exp'] = time.time() - 1
+        self.cache.put('token-a', self.payload)
+
+        self.assertIsNone(self.cache.get('token-a'))
+
+    def test_entry_expires_at_max_ttl(self):
+        self.cache.max_ttl = 0
+        self.cache.put('token-a', self.payload)
+
+        self.assertIsNone(self.cache.get('token-a'))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        for i in range(50):
+            self.cache.put('token-%s' % i, dict(self.payload, sub=str(i)))
+
+        self.assertLessEqual(self.cache.size, self.cache.max_bytes)
+        self.assertGreater(self.cache.stats()['evictions'], 0)
+        self.assertIsNone(self.cache.get('token-0'))
+        self.assertIsNotNone(self.cache.get('token-49'))
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()